@@ -0,0 +1,41 @@
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    map: {
+        // Map figure from the server with the presence layer switched on or off and the current zoom/center kept
+        render: function (figure, militaryPresence, relayoutData) {
+            if (!figure) {
+                return window.dash_clientside.no_update;
+            }
+
+            var zoom = 1.5;
+            var center = {lat: 24, lon: 0};
+            if (relayoutData) {
+                zoom = relayoutData["mapbox.zoom"] || 1.5;
+                center = relayoutData["mapbox.center"] || {lat: 24, lon: 0};
+            }
+
+            var data = figure.data.map(function (trace) {
+                if (trace.meta !== "presence") {
+                    return trace;
+                }
+                return Object.assign({}, trace, {visible: Boolean(militaryPresence)});
+            });
+            var mapbox = Object.assign({}, figure.layout.mapbox, {zoom: zoom, center: center});
+            var layout = Object.assign({}, figure.layout, {mapbox: mapbox});
+
+            return Object.assign({}, figure, {data: data, layout: layout});
+        },
+
+        // Number of zoom levels the current zoom is at or above, only sent to the server when it changes
+        zoomBucket: function (relayoutData, levels, bucket) {
+            if (!relayoutData || !("mapbox.zoom" in relayoutData)) {
+                return window.dash_clientside.no_update;
+            }
+
+            var zoom = relayoutData["mapbox.zoom"];
+            var next = levels.filter(function (level) {
+                return zoom >= level;
+            }).length;
+            return next === bucket ? window.dash_clientside.no_update : next;
+        }
+    }
+});
@@ -0,0 +1,57 @@
+import multiprocessing
+import os
+import shutil
+
+# Gunicorn settings of the production server (mdi.service), started with gunicorn -c gunicorn.conf.py wsgi:server.
+# The environment variables override the defaults, e.g. for util/load_test.py
+
+bind = os.getenv("MDI_BIND", "unix:mdi.sock")
+umask = 0o007
+timeout = int(os.getenv("MDI_TIMEOUT", 120))
+
+# Callbacks are CPU bound (pandas, plotly json) so one worker process per CPU, with a few threads each so that a slow
+# callback does not hold up the fast ones queued behind it on the same worker
+workers = int(os.getenv("MDI_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.getenv("MDI_THREADS", 4))
+worker_class = "gthread"
+
+# Import the app (data frames, snapshot, templates) once in the master, workers share the memory copy-on-write
+preload_app = os.getenv("MDI_PRELOAD", "1") != "0"
+
+# Render the popular dashboard views into the figure cache, MDI_WARMUP=0 to start cold
+warmup = os.getenv("MDI_WARMUP", "1") != "0"
+# Preloaded, the master warms before forking: every worker starts with the cache (warmed once instead of once per
+# worker) but no worker accepts requests until then. The master warms for at most this many seconds, the workers
+# warm the rest in the background
+warmup_budget = float(os.getenv("MDI_WARMUP_BUDGET", 10))
+warmed = False
+
+# Workers save their callback metrics here and /metrics merges them (mdi/metrics.py), emptied when the server starts
+metrics_dir = os.environ.setdefault("MDI_METRICS_DIR", os.path.abspath("metrics"))
+
+
+def on_starting(server):
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def when_ready(server):
+    global warmed
+    if preload_app and warmup:
+        from mdi.warmup import warm_cache
+        warmed = warm_cache(budget=warmup_budget)
+
+
+def post_fork(server, worker):
+    #Cache statistics of the worker start from 0, the entries warmed in the master are kept
+    if preload_app:
+        from mdi.figure_cache import figure_cache
+        figure_cache.reset_stats()
+    server.log.info("Worker spawned (pid: %s, threads: %s)", worker.pid, threads)
+
+
+def post_worker_init(worker):
+    #Not preloaded (or the master ran out of budget): the worker warms its cache in the background
+    if warmup and not warmed:
+        from mdi.warmup import start_warmup
+        start_warmup()
@@ -1,30 +1,29 @@
 import os
 
-import pandas as pd
 from dotenv import load_dotenv
 
 from dash import html, dcc, Input, Output, State, ctx, callback_context
 import dash_bootstrap_components as dbc
-from dash_bootstrap_templates import load_figure_template
 
 from .server import app
-from . import constants, card_texts
+from . import constants, card_texts, templates, metrics
 from .country_filter import country_filter_card, parse_content
+from .snapshot import load_deployments
 
 server = app.server
 
 load_dotenv()
 ROOT = os.getenv("PROJECT_ROOT")
 
+# data (memory-mapped snapshot, falls back to the xlsx if the snapshot is missing or stale), includes country colors
+df = load_deployments(ROOT)
 
-load_figure_template("litera")
-
-# data
-df = pd.read_excel(ROOT + "data/MDVA_Deployments_LatLon.xlsx")
-mapbox_access_token = open(ROOT + ".mapbox_token").read()
-
-# country colors
-df["Color"] = df["Country"].replace(to_replace=constants.country_colors)
+# map backend, "mapbox" (tiles of the Mapbox light style, fails without .mapbox_token) or "offline" (no token, no
+# tiles), MDI_MAP_BACKEND=offline
+map_backend = os.getenv("MDI_MAP_BACKEND", "mapbox")
+mapbox_access_token = None
+if map_backend == "mapbox":
+    mapbox_access_token = open(ROOT + ".mapbox_token").read()
 
 # deployments and presence
 df_deployments = df[df["MissionType"] == "Operation"]
@@ -352,6 +351,9 @@ app.layout = html.Div(
                 ),
                 dcc.Store(id="selected-countries"),
                 dcc.Store(id="selected-year"),
+                dcc.Store(id="map-figure"),
+                dcc.Store(id="map-zoom-levels", data=constants.map_zoom_levels),
+                dcc.Store(id="map-zoom-bucket", data=0),
             ],
             style={"background-color": "#fafafa"},
             fluid=True,
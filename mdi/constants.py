@@ -18,6 +18,9 @@ map_col_style = {"margin-left": "0.5rem", "margin-right": "0.5rem", "background"
                  "margin-bottom": "0.5rem", "margin-top": "0.5rem", "height": "37.5rem"}
 row_style = {"margin-bottom":"0.5rem", "margin-top":"0.5rem"}
 
+# map zoom levels from which the markers are aggregated less, zoom buckets 0, 1 and 2
+map_zoom_levels = [2, 4]
+
 organisation_colors = {
     "USA": "rgb(186, 12, 47)",
     "NATO": "rgb(72, 72, 72)",
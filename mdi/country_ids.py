@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+from . import constants
+
+# Integer id of every country code of constants.country_codes, ids follow the order of the codes so that sorting by
+# id sorts by country like the categorical Country columns
+codes = sorted(constants.country_codes)
+ids = {code: country_id for country_id, code in enumerate(codes)}
+# id of codes outside of constants.country_codes, never selected
+unknown = len(codes)
+
+
+def country_ids(countries):
+    """
+    :param countries: country codes
+    :return: integer ids of the countries
+    """
+    return pd.Series(np.asarray(countries, dtype=object)).map(ids).fillna(unknown).to_numpy(dtype=np.int64)
+
+
+def selection(countries):
+    """
+    :param countries: list of chosen country codes
+    :return: boolean lookup array indexed by country id, rows of a table are selected with selection[ids]
+    """
+    lookup = np.zeros(unknown + 1, dtype=bool)
+    lookup[[ids[country] for country in countries if country in ids]] = True
+    return lookup
+
+
+def sort_by_year_and_country(df):
+    """
+    :return: copy of the table with a CountryId column, sorted by year and country id
+    """
+    df = df.assign(CountryId=country_ids(df["Country"]))
+    return df.sort_values(by=["Year", "CountryId"], kind="stable")
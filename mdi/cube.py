@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+from .country_ids import country_ids, selection
+
+
+def encode(values):
+    """
+    :return: integer codes of the values and the labels of the codes, in the order groupby sorts them
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), values.cat.categories
+    labels, codes = np.unique(values.to_numpy(), return_inverse=True)
+    return codes, pd.Index(labels)
+
+
+class DeploymentCube:
+    """
+    Deployed summed once for every combination of the dimensions present in the deployments, so that the cards
+    aggregate a few hundred cells instead of grouping the rows of the selection again.
+    """
+    dimensions = ["Country", "Year", "Organisation", "Theatre", "MissionName"]
+
+    def __init__(self, df, value="Deployed"):
+        codes, self.labels, self.sizes = [], {}, {}
+        for dimension in self.dimensions:
+            dimension_codes, self.labels[dimension] = encode(df[dimension])
+            codes.append(dimension_codes.astype(np.int64))
+            self.sizes[dimension] = len(self.labels[dimension])
+
+        #One cell per combination, first is the first row of the cell to keep the order rows appear in
+        keys = np.ravel_multi_index(codes, [self.sizes[dimension] for dimension in self.dimensions])
+        keys, first, cell = np.unique(keys, return_index=True, return_inverse=True)
+        self.first = first
+        self.values = np.bincount(cell, weights=df[value].to_numpy(), minlength=len(keys)).astype(np.int64)
+        self.codes = dict(
+            zip(self.dimensions, np.unravel_index(keys, [self.sizes[dimension] for dimension in self.dimensions]))
+        )
+        self.country_ids = country_ids(self.labels["Country"])[self.codes["Country"]]
+        self.year_codes = {year: code for code, year in enumerate(self.labels["Year"])}
+
+    def cells(self, countries, year=None):
+        """
+        :return: boolean mask of the cells of the chosen countries (and year)
+        """
+        mask = selection(countries)[self.country_ids]
+        if year is not None:
+            mask &= self.codes["Year"] == self.year_codes.get(int(year), -1)
+        return mask
+
+    def sum(self, countries, year=None, by="Year"):
+        """
+        Same as df.groupby(by, observed=True)["Deployed"].sum() of the rows of the chosen countries (and year)
+        :param by: dimension or list of dimensions to group by
+        :return: series indexed by the groups
+        """
+        dimensions = [by] if isinstance(by, str) else list(by)
+        sizes = [self.sizes[dimension] for dimension in dimensions]
+        mask = self.cells(countries, year)
+
+        keys = np.ravel_multi_index([self.codes[dimension][mask] for dimension in dimensions], sizes)
+        sums = np.bincount(keys, weights=self.values[mask], minlength=np.prod(sizes)).astype(np.int64)
+        groups = np.flatnonzero(np.bincount(keys, minlength=np.prod(sizes)))
+
+        group_codes = np.unravel_index(groups, sizes)
+        if len(dimensions) == 1:
+            index = pd.Index(self.labels[by][group_codes[0]], name=by)
+        else:
+            index = pd.MultiIndex.from_arrays(
+                [self.labels[dimension][codes] for dimension, codes in zip(dimensions, group_codes)],
+                names=dimensions,
+            )
+        return pd.Series(sums[groups], index=index, name="Deployed")
+
+    def countries(self, countries, year=None):
+        """
+        Same as df["Country"].unique() of the rows of the chosen countries (and year)
+        :return: countries with deployments in the order they first appear in the rows
+        """
+        mask = self.cells(countries, year)
+        country_codes = self.codes["Country"][mask]
+        first = np.full(self.sizes["Country"], len(self.first))
+        np.minimum.at(first, country_codes, self.first[mask])
+        order = np.unique(country_codes)
+        order = order[np.argsort(first[order], kind="stable")]
+        return list(self.labels["Country"][order])
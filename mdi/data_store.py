@@ -0,0 +1,113 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .app import ROOT
+from .country_ids import selection, sort_by_year_and_country
+
+# Derived tables written by util/update_data.py, used by the dashboard cards
+tables = {
+    "mdi": "data/mdi.csv",
+    "active_personnel": "data/active_personnel.csv",
+    "deployment_per_capita": "data/deployment_per_capita.csv",
+    "top_organisations": "data/top_organisations.csv",
+}
+
+
+class Table:
+    """
+    CSV table kept in memory sorted by year and country id, with the row range of every year and the position of
+    every row in the file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.signature = self.file_signature()
+        df = pd.read_csv(path, delimiter=",")
+
+        self.df = sort_by_year_and_country(df)
+        self.file_order = self.df.index.to_numpy()
+        self.country_ids = self.df["CountryId"].to_numpy()
+        years = self.df["Year"].to_numpy()
+        self.years = {
+            int(year): (np.searchsorted(years, year, "left"), np.searchsorted(years, year, "right"))
+            for year in np.unique(years)
+        }
+
+    def file_signature(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def is_stale(self):
+        try:
+            return self.file_signature() != self.signature
+        except OSError:
+            #File is being replaced, keep serving the loaded data
+            return False
+
+    def select(self, countries, year=None):
+        """
+        :param countries: list of country codes
+        :param year: year to select, None for all years
+        :return: rows of the selected countries (and year) in the original file order
+        """
+        if year is None:
+            start, stop = 0, len(self.df)
+        else:
+            start, stop = self.years.get(int(year), (0, 0))
+
+        positions = start + np.flatnonzero(selection(countries)[self.country_ids[start:stop]])
+        positions = positions[np.argsort(self.file_order[positions], kind="stable")]
+        return self.df.iloc[positions]
+
+
+class DataStore:
+    """
+    Process-wide store of the derived tables. Tables are loaded once per worker and reloaded when their file
+    on disk changes.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.tables = {name: Table(root + path) for name, path in tables.items()}
+        #Incremented every time a table is reloaded
+        self.version = 0
+
+    def table(self, name):
+        table = self.tables[name]
+        if table.is_stale():
+            with self.lock:
+                if self.tables[name].is_stale():
+                    self.tables[name] = Table(table.path)
+                    self.version += 1
+                table = self.tables[name]
+        return table
+
+    def refresh(self):
+        """
+        Reload tables whose files changed
+        :return: current version of the store
+        """
+        for name in self.tables:
+            self.table(name)
+        return self.version
+
+    # MDI values for all years
+    def mdi(self, countries):
+        return self.table("mdi").select(countries)
+
+    # Active personnel for a year
+    def active_personnel(self, countries, year):
+        return self.table("active_personnel").select(countries, year)
+
+    # Deployments per capita for a year
+    def deployment_per_capita(self, countries, year):
+        return self.table("deployment_per_capita").select(countries, year)
+
+    # Top organisations for a year
+    def top_organisations(self, countries, year):
+        return self.table("top_organisations").select(countries, year)
+
+
+store = DataStore(ROOT)
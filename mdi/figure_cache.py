@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class FigureCache:
+    """
+    Bounded LRU cache with expiry for rendered dashboard outputs. Everything is dropped when the version of the
+    underlying data changes.
+    """
+    def __init__(self, size=256, ttl=3600):
+        """
+        :param size: maximum number of entries, 0 disables the cache
+        :param ttl: seconds after which an entry expires, 0 for no expiry
+        """
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.version = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, version):
+        """
+        :return: cached value, None if missing, expired or the data version changed
+        """
+        with self.lock:
+            if version != self.version:
+                if self.entries:
+                    self.invalidations += 1
+                self.entries.clear()
+                self.version = version
+
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl and time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, version):
+        if not self.size:
+            return None
+
+        with self.lock:
+            #Computed from data that has been reloaded in the meantime
+            if version != self.version:
+                return None
+
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, version, compute):
+        value = self.get(key, version)
+        if value is None:
+            value = compute()
+            self.put(key, value, version)
+        return value
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "size": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+figure_cache = FigureCache(
+    size=int(os.getenv("MDI_FIGURE_CACHE_SIZE", 256)),
+    ttl=int(os.getenv("MDI_FIGURE_CACHE_TTL", 3600)),
+)
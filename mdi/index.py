@@ -17,66 +17,85 @@ def combined_z_scores(z1, z2, w1, w2):
     )
 
 
-def rescale(values, new_min=0, new_max=100):
-    output = []
-    old_min, old_max = min(values), max(values)
-
-    for v in values:
-        new_v = (new_max - new_min) / (old_max - old_min) * (v - old_min) + new_min
-        output.append(new_v)
-
-    return output
-
-
-def calculate_mdi(df_deployments, year):
-    year = str(year)
-    df_deployments = df_deployments.sort_values(by="Country")
-
-    all_countries = df_deployments["Country"].unique()
-    df_statistics = pd.DataFrame({"Country": all_countries})
-
-    # population
-    df_population = pd.read_csv(ROOT + "data/MDVA_Population.csv", delimiter=",")
-    df_population = df_population.query("Country in @all_countries")
+def rescale(values, new_min=0, new_max=100, axis=None):
+    values = np.asarray(values)
+    old_min = values.min(axis=axis, keepdims=True)
+    old_max = values.max(axis=axis, keepdims=True)
+
+    return (new_max - new_min) / (old_max - old_min) * (values - old_min) + new_min
+
+
+def load_population():
+    return pd.read_csv(ROOT + "data/MDVA_population.csv", delimiter=",")
+
+
+def calculate_mdi_all_years(df_deployments, df_population, years=None):
+    """
+    :param df_deployments: deployments to operations
+    :param df_population: population table as in data/MDVA_population.csv (one column per year)
+    :param years: years to calculate, all years in df_deployments if None
+    :return: statistics and MDI for every year and every country with deployments in any year
+    """
+    all_countries = df_deployments.sort_values(by="Country")["Country"].unique()
+
+    if years is None:
+        years = df_deployments["Year"].unique()
+    else:
+        df_deployments = df_deployments[df_deployments["Year"].isin(years)]
+    years = [int(year) for year in years]
+
+    # total deployed (years x countries)
+    total_deployments = (
+        df_deployments.groupby(["Year", "Country"], observed=True)["Deployed"]
+        .sum()
+        .unstack(fill_value=0)
+        .reindex(index=years, columns=all_countries, fill_value=0)
+        .to_numpy()
+    )
 
-    # total deployed
-    df_deployments = df_deployments[df_deployments["Year"] == int(year)]
-    total_deployments = df_deployments.groupby(["Country"])["Deployed"].sum().to_list()
-    df_statistics["Total"] = total_deployments
+    # population (years x countries)
+    population = (
+        df_population.set_index("Country")
+        .loc[all_countries, [str(year) for year in years]]
+        .astype("int64")
+        .to_numpy()
+        .T
+    )
 
     # per capita deployment
-    deployments_per_capita = []
-    population = []
-    for country in all_countries:
-        total_deployed = int(
-            df_statistics[df_statistics["Country"] == country]["Total"]
-        )
+    deployments_per_capita = total_deployments / population
 
-        pop = int(df_population[df_population["Country"] == country][year])
-        population.append(pop)
-
-        per_capita = total_deployed / pop
-        deployments_per_capita.append(per_capita)
-
-    df_statistics["PerCapita"] = deployments_per_capita
-    df_statistics["Population"] = population
-
-    # z-scores
-    total_z = sts.zscore(total_deployments)
-    df_statistics["Total-Z"] = total_z
-
-    percapita_z = sts.zscore(deployments_per_capita)
-    df_statistics["PerCapita-Z"] = percapita_z
+    # z-scores within each year
+    total_z = sts.zscore(total_deployments, axis=1)
+    percapita_z = sts.zscore(deployments_per_capita, axis=1)
 
     # combined_z_total_percapita = combined_z_scores(
     #     np.array(percapita_z), np.array(total_z), 1, 1
     # )
 
-    combined_z_total_percapita = np.array(percapita_z) + np.array(total_z)
-    df_statistics["Combined-Z_Total_PerCapita"] = combined_z_total_percapita
+    combined_z_total_percapita = percapita_z + total_z
 
     # mdi = sts.norm.cdf(combined_z_total_percapita) * 2.5
-    mdi = np.round(rescale(combined_z_total_percapita, 0, 100), 0).astype(int)
-    df_statistics["MDI"] = mdi
+    mdi = np.round(rescale(combined_z_total_percapita, 0, 100, axis=1), 0).astype(int)
+
+    return pd.DataFrame(
+        {
+            "Country": np.tile(all_countries, len(years)),
+            "Total": total_deployments.ravel(),
+            "PerCapita": deployments_per_capita.ravel(),
+            "Population": population.ravel(),
+            "Total-Z": total_z.ravel(),
+            "PerCapita-Z": percapita_z.ravel(),
+            "Combined-Z_Total_PerCapita": combined_z_total_percapita.ravel(),
+            "MDI": mdi.ravel(),
+            "Year": np.repeat(years, len(all_countries)),
+        }
+    )
+
+
+def calculate_mdi(df_deployments, year, df_population=None):
+    if df_population is None:
+        df_population = load_population()
 
-    return df_statistics
+    df_statistics = calculate_mdi_all_years(df_deployments, df_population, years=[year])
+    return df_statistics.drop(columns="Year")
@@ -0,0 +1,249 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from flask import Response, g, request
+
+from .server import app
+
+# Timing of every dash callback request, exposed at /metrics in the Prometheus text format. MDI_METRICS=0 registers
+# nothing, so the requests run exactly as without it
+enabled = os.getenv("MDI_METRICS", "1") != "0"
+# Quantiles are computed over the last requests of every callback
+window = int(os.getenv("MDI_METRICS_WINDOW", 1000))
+quantiles = [0.5, 0.9, 0.99]
+# Every gunicorn worker saves its metrics to <pid>.json in this directory (set by gunicorn.conf.py) at most every
+# interval seconds after a request, /metrics of any worker merges the files so that the counters do not jump between
+# workers. Totals of exited workers are kept, quantiles are over the running ones. Without a directory (dash dev
+# server) /metrics is of the one process
+directory = os.getenv("MDI_METRICS_DIR")
+interval = float(os.getenv("MDI_METRICS_INTERVAL", 5))
+
+# Values recorded for every callback request, in this order
+measures = {
+    "wall_seconds": "Wall time of the callback request",
+    "cpu_seconds": "CPU time of the thread serving the callback request",
+    "response_bytes": "Size of the uncompressed callback response",
+    "selected_countries": "Number of selected countries the callback got",
+}
+
+# Components holding the country selection and the year
+country_ids = {"selected-countries", "country-filter"}
+year_ids = {"selected-year", "year-slider"}
+
+
+class CallbackMetrics:
+    """
+    Last requests of every callback with totals since the worker started. Every worker process keeps its own, saved to
+    the directory if there is one.
+    """
+    def __init__(self, window, directory=None, interval=5.0):
+        self.window = window
+        self.directory = directory
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.pid = None
+        self.save_timer = None
+        self.samples = {}
+        self.sums = {}
+        self.counts = {}
+        self.years = {}
+
+    def path(self):
+        return os.path.join(self.directory, f"{self.pid}.json")
+
+    def check_pid(self):
+        #A forked worker starts from nothing, or from the totals of an exited worker it got the pid of
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.save_timer = None
+        self.samples, self.sums, self.counts, self.years = {}, {}, {}, {}
+        state = read_state(self.path()) if self.directory else None
+        if state is not None:
+            self.sums = {callback: np.array(values) for callback, values in state["sums"].items()}
+            self.counts = {callback: np.array(values) for callback, values in state["counts"].items()}
+            self.years = {(callback, year): count for callback, year, count in state["years"]}
+
+    def record(self, callback, values, year=None):
+        """
+        :param values: values of the request in the order of measures, NaN if not known
+        :param year: selected year, None if the callback does not get one
+        """
+        with self.lock:
+            self.check_pid()
+            if callback not in self.samples:
+                self.samples[callback] = deque(maxlen=self.window)
+            if callback not in self.sums:
+                self.sums[callback] = np.zeros(len(measures))
+                self.counts[callback] = np.zeros(len(measures), dtype=int)
+            self.samples[callback].append(values)
+            self.sums[callback] += np.nan_to_num(values)
+            self.counts[callback] += ~np.isnan(values)
+            self.years[callback, year] = self.years.get((callback, year), 0) + 1
+
+            if self.directory and self.save_timer is None:
+                self.save_timer = threading.Timer(self.interval, self.save)
+                self.save_timer.daemon = True
+                self.save_timer.start()
+
+    def state(self):
+        #Json serialisable copy of the metrics, the lock must be held
+        return {
+            "pid": self.pid,
+            "samples": {callback: [list(values) for values in samples] for callback, samples in self.samples.items()},
+            "sums": {callback: values.tolist() for callback, values in self.sums.items()},
+            "counts": {callback: values.tolist() for callback, values in self.counts.items()},
+            "years": [[callback, year, count] for (callback, year), count in self.years.items()],
+        }
+
+    def save(self):
+        with self.lock:
+            self.check_pid()
+            self.save_timer = None
+            state = self.state()
+
+        #Replaced in one go, the other workers never read half a file
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.path() + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path())
+
+    def states(self):
+        """
+        :return: metrics of this worker and the saved ones of the others, without the samples of exited workers
+        """
+        with self.lock:
+            self.check_pid()
+            states = [self.state()]
+        if not self.directory or not os.path.isdir(self.directory):
+            return states
+
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json") or name == f"{self.pid}.json":
+                continue
+            state = read_state(os.path.join(self.directory, name))
+            if state is None:
+                continue
+            if not running(state["pid"]):
+                state["samples"] = {}
+            states.append(state)
+        return states
+
+    def render(self):
+        """
+        :return: metrics of all workers in the Prometheus text format, quantiles as summaries
+        """
+        samples, sums, counts, years = {}, {}, {}, {}
+        for state in self.states():
+            for callback, values in state["samples"].items():
+                samples.setdefault(callback, []).extend(values)
+            for callback, values in state["sums"].items():
+                sums[callback] = sums.get(callback, 0) + np.array(values)
+            for callback, values in state["counts"].items():
+                counts[callback] = counts.get(callback, 0) + np.array(values)
+            for callback, year, count in state["years"]:
+                years[callback, year] = years.get((callback, year), 0) + count
+        samples = {
+            callback: np.array(samples.get(callback, []), dtype=float).reshape(-1, len(measures)) for callback in sums
+        }
+
+        lines = []
+        for column, (measure, description) in enumerate(measures.items()):
+            name = f"mdi_callback_{measure}"
+            lines.append(f"# HELP {name} {description}, quantiles over the last {self.window} requests of every worker")
+            lines.append(f"# TYPE {name} summary")
+            for callback, values in samples.items():
+                if not counts[callback][column]:
+                    continue
+                label = f'callback="{escape(callback)}"'
+                values = values[:, column]
+                if not np.isnan(values).all():
+                    for quantile, value in zip(quantiles, np.nanquantile(values, quantiles)):
+                        lines.append(f'{name}{{{label},quantile="{quantile}"}} {value:.6g}')
+                lines.append(f"{name}_sum{{{label}}} {sums[callback][column]:.6g}")
+                lines.append(f"{name}_count{{{label}}} {counts[callback][column]}")
+
+        lines.append("# HELP mdi_callback_requests_total Callback requests by selected year")
+        lines.append("# TYPE mdi_callback_requests_total counter")
+        for (callback, year), count in years.items():
+            year = "none" if year is None else year
+            lines.append(f'mdi_callback_requests_total{{callback="{escape(callback)}",year="{escape(year)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def read_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def callback_name(body):
+    #Output ids of the callback, e.g. card-line or selected-year,map-figure,selected-countries
+    outputs = body.get("outputs", [])
+    if isinstance(outputs, dict):
+        outputs = [outputs]
+    return ",".join(
+        output["id"] if isinstance(output["id"], str) else json.dumps(output["id"], sort_keys=True)
+        for output in outputs
+    )
+
+
+def selection(body):
+    """
+    :return: number of selected countries (NaN if the callback does not get them) and the year (None)
+    """
+    countries, year = np.nan, None
+    for item in body.get("inputs", []) + body.get("state", []):
+        if not isinstance(item, dict):
+            continue
+        if item.get("id") in country_ids and isinstance(item.get("value"), list):
+            countries = len(item["value"])
+        elif item.get("id") in year_ids and item.get("value") is not None:
+            year = item["value"]
+    return countries, year
+
+
+callback_metrics = CallbackMetrics(window, directory, interval)
+callback_path = app.config.routes_pathname_prefix + "_dash-update-component"
+
+if enabled:
+    @app.server.before_request
+    def start_timer():
+        if request.path == callback_path:
+            g.callback_start = (time.perf_counter(), time.thread_time())
+
+    @app.server.after_request
+    def record_callback(response):
+        #Runs before the response is compressed (after_request functions run in reverse order of registration)
+        if "callback_start" in g:
+            wall, cpu = time.perf_counter() - g.callback_start[0], time.thread_time() - g.callback_start[1]
+            body = request.get_json(silent=True) or {}
+            countries, year = selection(body)
+            size = response.calculate_content_length() or 0
+            callback_metrics.record(callback_name(body), (wall, cpu, size, countries), year)
+        return response
+
+    @app.server.route("/metrics")
+    def metrics():
+        return Response(callback_metrics.render(), mimetype="text/plain; version=0.0.4")
@@ -3,13 +3,11 @@ import numpy as np
 from collections import Counter
 
 from dash import Input, Output, State, exceptions
-import plotly.express as px
-import plotly.graph_objects as go
 import dash_bootstrap_components as dbc
 from dash import html, dcc, Input, Output, State
 
 from .server import app
-from . import constants
+from . import constants, templates
 
 graph_config = dict(displaylogo=False, displayModeBar=False)
 
@@ -35,31 +33,27 @@ def line_chart(data_groups):
     :param data_groups: list of dictionaries of datasets
     :return:
     """
-    fig = go.Figure()
-
-    for data_group in data_groups:
-        fig.add_trace(go.Scatter(x=data_group["x"], y=data_group["y"],
-                                 mode='lines+markers',
-                                 name='lines+markers',
-                                 showlegend=False,
-                                 line=dict(color=data_group["colour"]),
-                                 hovertemplate=f"{data_group['x_label']}" + " : %{x}<br>"
-                                               + f"{data_group['y_label']}" + ": %{y:,}"
-                                               + "<extra></extra>",
-                                 ))
-
-    fig.update_layout(title=data_groups[0]["title"],
-                      xaxis_title=data_groups[0]["x_label"],
-                      yaxis_title=data_groups[0]["y_label"])
-    fig.update_yaxes(
-        title_standoff=constants.theme["title_standoff"],
-        tickfont_size=constants.theme["tickfont_size"],
-        titlefont_size=constants.theme["titlefont_size"],
-    )
-    fig.update_xaxes(
-        title_standoff=constants.theme["title_standoff"],
-        tickfont_size=constants.theme["tickfont_size"],
-        dtick=1,
+    data = [
+        dict(type="scatter", x=data_group["x"], y=data_group["y"],
+             mode='lines+markers',
+             name='lines+markers',
+             showlegend=False,
+             line=dict(color=data_group["colour"]),
+             hovertemplate=f"{data_group['x_label']}" + " : %{x}<br>"
+                           + f"{data_group['y_label']}" + ": %{y:,}"
+                           + "<extra></extra>",
+             )
+        for data_group in data_groups
+    ]
+
+    fig = templates.figure(
+        templates.line_chart,
+        data=data,
+        layout=dict(
+            title=dict(text=data_groups[0]["title"]),
+            xaxis=dict(title=dict(text=data_groups[0]["x_label"])),
+            yaxis=dict(title=dict(text=data_groups[0]["y_label"])),
+        ),
     )
 
     return fig
@@ -94,53 +88,8 @@ def horizontal_bar_plot(
             font_size-=3
 
 
-    #Make the plot
-    fig = go.Figure(
-        data=[
-            go.Bar(
-                y=countries,
-                x=values,
-                orientation="h",
-                marker=dict(color=colour),
-                width=np.full(len(values), bar_width_ration),
-            )
-        ],
-        layout={
-            "margin": {"pad": 20},
-        },
-    )
-
-    #Make the bard
-    fig.add_trace(
-        go.Bar(
-            y=countries,
-            x=[max_value - value for value in values],
-            orientation="h",
-            marker=dict(color="#D4D4D4"),
-            width=np.full(len(values), bar_width_ration),
-        )
-    )
-    #Remove hover and legend
-    fig.update_traces(hoverinfo="skip")
-    fig.update(layout_showlegend=False)
-
-    #Remove background colour and all axes
-    fig.update_layout(
-        paper_bgcolor="rgb(0,0,0,0)",
-        plot_bgcolor="rgba(0,0,0,0)",
-        barmode="stack",
-        yaxis={"categoryorder": "array", "categoryarray": countries},
-        font=dict(size=font_size),
-        height=650,
-        margin=dict(l=0, r=0, t=0, b=0),
-    )
-    fig.update_xaxes(
-        showticklabels=False, automargin=True, showgrid=False, visible=False
-    )
-    fig.update_yaxes(automargin=True, showgrid=False)
-    annotations = []
-
     #Add country and value annotation to each side of the bar
+    annotations = []
     for value, country in zip(bar_labels, countries):
         if percentage:
             value_str = str(value) + "%"
@@ -149,16 +98,42 @@ def horizontal_bar_plot(
 
         annotations.append(
             dict(
-                xref="x1",
-                yref="y1",
                 y=country,
                 x=max_value + 0.03 * max_value,
                 text=value_str,
-                showarrow=False,
-                xshift=15,
             )
         )
-    fig.update_layout(annotations=annotations)
+
+    #Make the plot, the bars and the bard behind them, no hover, legend, background colour or x axis
+    fig = templates.figure(
+        templates.horizontal_bar,
+        data=[
+            dict(
+                type="bar",
+                y=countries,
+                x=values,
+                orientation="h",
+                marker=dict(color=colour),
+                width=np.full(len(values), bar_width_ration),
+                hoverinfo="skip",
+            ),
+            dict(
+                type="bar",
+                y=countries,
+                x=[max_value - value for value in values],
+                orientation="h",
+                marker=dict(color="#D4D4D4"),
+                width=np.full(len(values), bar_width_ration),
+                hoverinfo="skip",
+            ),
+        ],
+        layout=dict(
+            yaxis={"categoryorder": "array", "categoryarray": countries},
+            font=dict(size=font_size),
+            height=650,
+            annotations=annotations,
+        ),
+    )
     return fig
 
 #Meter plot
@@ -186,9 +161,11 @@ def meter_plot(
 
     }
     #Make the meter plot
-    fig = go.Figure(
+    fig = templates.figure(
+        templates.meter,
         data=[
-            go.Indicator(
+            dict(
+                type="indicator",
                 value=indicator_value,
                 mode="gauge+number",
                 gauge= gauge,
@@ -196,48 +173,41 @@ def meter_plot(
                 #Add percentage value bellow the meter
                 number={"suffix": "%", "font": {"size": indicator_font_size}},
             )
-        ]
-    )
-
-    #Add value annotation
-    fig.add_annotation(
-        x=0.49,
-        y=0.45,
-        text="{:,}".format(absolute_value),
-        font=dict(size=15),
-        showarrow=False,
-    )
-    #Some styling
-    fig.update_layout(
-        margin=dict(l=0, r=0, t=1, b=0),
-        height=120,
-        paper_bgcolor="rgb(0,0,0,0)",
-        plot_bgcolor="rgba(0,0,0,0)",
+        ],
+        #Add value annotation
+        layout=dict(
+            height=120,
+            annotations=[dict(text="{:,}".format(absolute_value))],
+        ),
     )
     return fig
 
 #Bar plot of summary of orgs contribution to deployment for each country
 def country_orgs_bar_plot(df, country_order=None, condensed=False):
-    # To supress Settings with copy warning
-    pd.options.mode.chained_assignment = None
-    df.rename(columns={"Organisation": "Command"}, inplace=True)
+    """
+    :param df: deployments of each country by organisation (Country, Organisation, Deployed and
+               Percentage of Total Deployment), rows of the same country and organisation are added up
+    :param country_order: order of the countries on the axis, None to keep the order they appear in
+    :param condensed: smaller font and margins
+    :return: bars of the countries stacked by organisation (command), horizontal bars of the commands if one country
+    """
+    # Deployed and share of every command (columns, in order of appearance) for every country (rows)
+    deployed = df.pivot_table(index="Country", columns="Organisation", values="Deployed", aggfunc="sum", sort=False)
+    share = df.pivot_table(index="Country", columns="Organisation", values="Percentage of Total Deployment",
+                           aggfunc="sum", sort=False)
+    countries = deployed.index.to_numpy()
+    commands = list(deployed.columns)
 
     # Width of floating bar and graph height, less countries = thicker bar & larger height
     font_size = constants.theme["titlefont_size"]
-    if len(df["Country"].unique()) > 10:
+    if len(countries) > 10:
             font_size -= 3
 
-    #If one country make bars horizontal
-    if len(df["Country"].unique()) == 1:
-        #Select which data to plot on which axis, graph orientation and axes styling
-        x = "Deployed"
-        y ="Command"
+    #If one country make bars horizontal, the commands from top to bottom
+    if len(countries) == 1:
         orientation = "h"
-        xaxis_title = "Deployed"
-        yaxis_title = None
-        xaxis_tickformat = ","
-        yaxis_tickformat = None
-        xaxis = None
+        xaxis = {"anchor": "y", "domain": [0.0, 1.0]}
+        yaxis = {"anchor": "x", "domain": [0.0, 1.0], "categoryorder": "array", "categoryarray": commands[::-1]}
         # Hover template
         hover_template = "<b>Command: %{customdata[0]}</b><br>"\
                          + "Deployed: %{x:,} <br>"\
@@ -246,16 +216,12 @@ def country_orgs_bar_plot(df, country_order=None, condensed=False):
 
     #If more than one country, make bard vertical
     else:
-        # Select which data to plot on which axis, graph orientation and axes styling
-        x = "Country"
-        y = "Deployed"
-        orientation = None
-        xaxis_title = None
-        yaxis_title = "Deployed"
-        xaxis_tickformat = None
-        yaxis_tickformat = ","
+        orientation = "v"
         #Order bars from highest deployment to lowest
-        xaxis = {"categoryorder": "array", "categoryarray": country_order}
+        xaxis = {"anchor": "y", "domain": [0.0, 1.0], "categoryorder": "array"}
+        if country_order is not None:
+            xaxis["categoryarray"] = list(country_order)
+        yaxis = {"anchor": "x", "domain": [0.0, 1.0], "title": {"text": "Deployed"}, "tickformat": ","}
         #Hover template
         hover_template = "<b>Country: %{x}</b><br>"\
                          + "<b>Command: %{customdata[0]}</b><br>"\
@@ -263,71 +229,72 @@ def country_orgs_bar_plot(df, country_order=None, condensed=False):
                          + "Share: %{customdata[1]:.3}% <br>"\
                          + "<extra></extra>"
 
-    #Create figure with all styling defined above
-    fig = px.bar(
-        df,
-        x=x,
-        y=y,
-        color="Command",
-        orientation=orientation,
-        color_discrete_map={
-            **constants.organisation_colors,
-            **constants.country_colors,
-        },
-        custom_data=["Command", "Percentage of Total Deployment"],
-    )
-    fig.update_layout(
+    #One trace per command with the countries it has deployments of
+    data = []
+    for command in commands:
+        present = deployed[command].notna().to_numpy()
+        values = deployed[command].to_numpy()[present].astype(df["Deployed"].dtype)
+        bars = countries[present] if orientation == "v" else np.full(len(values), command, dtype=object)
+        data.append(
+            dict(
+                type="bar",
+                name=command,
+                legendgroup=command,
+                offsetgroup=command,
+                alignmentgroup="True",
+                orientation=orientation,
+                x=bars if orientation == "v" else values,
+                y=values if orientation == "v" else bars,
+                xaxis="x",
+                yaxis="y",
+                marker=dict(
+                    color=constants.country_colors.get(
+                        command,
+                        constants.organisation_colors.get(command, constants.organisation_colors.get("default")),
+                    ),
+                    pattern=dict(shape=""),
+                ),
+                customdata=np.column_stack(
+                    [np.full(len(values), command, dtype=object), share[command].to_numpy()[present]]
+                ),
+                hovertemplate=hover_template,
+                textposition="auto",
+                showlegend=True,
+            )
+        )
+
+    #Styling that depends on the data
+    layout = dict(
         margin=dict(l=100, r=0, t=0, b=0),
-        xaxis_title=xaxis_title,
-        yaxis_title=yaxis_title,
-        xaxis_tickformat=xaxis_tickformat,
-        yaxis_tickformat=yaxis_tickformat,
         xaxis=xaxis,
+        yaxis=yaxis,
+        legend=dict(title=dict(text="Command"), tracegroupgap=0),
+        barmode="relative",
         font=dict(size=font_size),
+        height=650,
     )
-    fig.update_traces(hovertemplate=hover_template)
 
-    if len(df["Country"].unique()) == 2:
-        fig.update_layout(
-            xaxis_tickangle=0,
-        )
+    if len(countries) == 2:
+        xaxis["tickangle"] = 0
     #If graoh should be condensed change styling
     if condensed:
-        fig.update_layout(
+        layout.update(
             font=dict(
                 size=12,
             ),
-            xaxis_tickangle=0,
             margin=dict(l=0, r=0, t=30, b=0),
         )
-    fig.update_xaxes(
-        title_standoff=constants.theme["title_standoff"],
-        tickfont_size=constants.theme["tickfont_size"],
-        titlefont_size=constants.theme["titlefont_size"],
-        ticksuffix="    ",
-    )
-    fig.update_yaxes(
-        title_standoff=constants.theme["title_standoff"],
-        tickfont_size=constants.theme["tickfont_size"],
-        titlefont_size=constants.theme["titlefont_size"],
-        ticksuffix="     ",
-    )
-    fig.update_layout(
-        paper_bgcolor="rgb(0,0,0,0)",
-        plot_bgcolor="rgba(0,0,0,0)",
-        legend=dict(bgcolor="rgba(0,0,0,0)"),
-        height=650,
-    )
+        xaxis["tickangle"] = 0
 
-    return fig
+    return templates.figure(templates.orgs_bar, data=data, layout=layout)
 
-def _card_extras(card_info=None, title="", full_graph=None, modal_id=""):
+def _card_extras(card_info=None, title="", expand=False, modal_id=""):
     # Define expand_button&modal_overlay as empty
     expand_button = ""
     modal_overlay = ""
     # If want to include the full graph in modal (i.e if more than 5 countries selected)
-    if full_graph is not None:
-        modal_overlay = modal_overlay_template(modal_id, full_graph)
+    if expand:
+        modal_overlay = modal_overlay_template(modal_id)
         expand_button = html.I(
             className="fas fa-plus-square",
             id=f"expand_{modal_id}",
@@ -369,7 +336,7 @@ def summary_graph_card(
     card_info,
     graph,
     modal_id=None,
-    full_graph=None,
+    expand=False,
     title_colour=constants.colors["cardName"],
     title_colour_highlighted=False
 ):
@@ -380,7 +347,8 @@ def summary_graph_card(
     :param card_info: Text inside info circle
     :param graph: Graph inside the card
     :param modal_id: Modal id (valid if want to expand a graph through a plus-button)
-    :param full_graph: Graph inside modal (valid if want to expand a graph through a plus-button)
+    :param expand: If want to expand a graph through a plus-button, the graph inside the modal is loaded when the
+                   button is clicked
     :param title_colour: Card title colour
     :param title_colour_highlighted: If true, title colour has larger font size and is in red colour
     :return: Dash card element
@@ -407,7 +375,7 @@ def summary_graph_card(
                              )
 
     #info circle and modal
-    card_extras = _card_extras(card_info=card_info, title=title, full_graph=full_graph, modal_id=modal_id)
+    card_extras = _card_extras(card_info=card_info, title=title, expand=expand, modal_id=modal_id)
 
     #Make the card
     card = dbc.CardBody(
@@ -437,10 +405,10 @@ def summary_graph_card(
     return card
 
 #Card for two graphs (i.e two meter plots when 2 countries selected)
-def comparison_summary_graph_card(side_1, side_2, card_info, full_graph=None, modal_id=None):
+def comparison_summary_graph_card(side_1, side_2, card_info, expand=False, modal_id=None):
 
     # info circle and modal
-    card_extras = _card_extras(card_info=card_info, title="", full_graph=full_graph, modal_id=modal_id)
+    card_extras = _card_extras(card_info=card_info, title="", expand=expand, modal_id=modal_id)
 
     card = dbc.CardBody(
         [
@@ -514,12 +482,12 @@ def comparison_summary_graph_card(side_1, side_2, card_info, full_graph=None, mo
 
     return card
 
-#Template for modal (full graph pop-up)
-def modal_overlay_template(id, graph):
+#Template for modal (full graph pop-up), the graph is put in by a callback when the expand button is clicked
+def modal_overlay_template(id):
     modal = dbc.Modal(
         [
             dbc.ModalBody(
-                dcc.Graph(figure=graph, config=graph_config, style={"height":graph.layout.height}), id=f"expand-{id}-md"
+                dcc.Loading(id=f"expand-{id}-md")
             ),
             dbc.ModalFooter(dbc.Button("Close", id=f"expand-{id}-close")),
         ],
@@ -528,3 +496,7 @@ def modal_overlay_template(id, graph):
     )
 
     return modal
+
+#Graph inside the modal
+def modal_graph(graph):
+    return dcc.Graph(figure=graph, config=graph_config, style={"height":graph["layout"]["height"]})
@@ -1,4 +1,8 @@
+import os
+
 from dash import Dash
+from flask import request
+from flask_compress import Compress
 
 import dash_bootstrap_components as dbc
 
@@ -9,3 +13,31 @@ app = Dash(
     external_stylesheets=[dbc.themes.BOOTSTRAP, dbc.icons.FONT_AWESOME],
     suppress_callback_exceptions=True,
 )
+
+# Responses (callback figure json, bundles) compressed with brotli or gzip, whichever the browser accepts. Levels and
+# the smallest response worth compressing are configurable, MDI_COMPRESS=0 leaves compression to the proxy
+app.server.config.update(
+    COMPRESS_ALGORITHM=["br", "gzip"],
+    COMPRESS_LEVEL=int(os.getenv("MDI_COMPRESS_LEVEL", 6)),
+    COMPRESS_BR_LEVEL=int(os.getenv("MDI_COMPRESS_BR_LEVEL", 4)),
+    COMPRESS_MIN_SIZE=int(os.getenv("MDI_COMPRESS_MIN_SIZE", 500)),
+)
+if os.getenv("MDI_COMPRESS", "1") != "0":
+    Compress(app.server)
+
+# Seconds browsers keep assets/ and the component bundles that are not fingerprinted. Assets are linked with their
+# modification time (?m=...), fingerprinted bundles are already kept for a year by dash
+static_max_age = int(os.getenv("MDI_STATIC_MAX_AGE", 7 * 24 * 3600))
+app.server.config["SEND_FILE_MAX_AGE_DEFAULT"] = static_max_age
+
+
+@app.server.after_request
+def cache_component_suites(response):
+    if (
+        request.path.startswith(app.config.routes_pathname_prefix + "_dash-component-suites/")
+        and response.status_code == 200
+        and response.cache_control.max_age is None
+    ):
+        response.cache_control.public = True
+        response.cache_control.max_age = static_max_age
+    return response
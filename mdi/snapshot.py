@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from . import constants
+
+# Columnar snapshot of the deployments spreadsheet. Every column is stored as its own .npy file so that it can be
+# memory-mapped at load time, string columns are dictionary encoded (integer codes + categories in the manifest).
+# The manifest also keeps a hash of the source file, a stale snapshot is ignored and the xlsx is parsed instead.
+SNAPSHOT_DIR = "data/snapshot/"
+DEPLOYMENTS_SOURCE = "data/MDVA_Deployments_LatLon.xlsx"
+
+categorical_columns = ["Theatre", "Country", "Organisation", "MissionName", "MissionType", "Color"]
+integer_columns = ["Year", "Deployed"]
+float_columns = ["Lat", "Lon"]
+
+
+def file_hash(path, extra=None):
+    """
+    :param path: file to hash
+    :param extra: json serialisable object whose change should also invalidate the hash (e.g. colour mapping)
+    :return: sha256 hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    if extra is not None:
+        digest.update(json.dumps(extra, sort_keys=True).encode())
+
+    return digest.hexdigest()
+
+
+def prepare_deployments(df):
+    #Country colours and typed columns
+    df["Color"] = df["Country"].replace(to_replace=constants.country_colors)
+
+    for column in categorical_columns:
+        df[column] = df[column].astype("category")
+    for column in integer_columns:
+        df[column] = df[column].astype("int64")
+    for column in float_columns:
+        df[column] = df[column].astype("float64")
+
+    return df
+
+
+def write_snapshot(df, name, source_hash, root):
+    path = root + SNAPSHOT_DIR + name
+    #Per process, workers that miss the snapshot at the same time write their own copy
+    tmp_path = f"{path}.tmp{os.getpid()}"
+
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    columns = []
+    for i, column in enumerate(df.columns):
+        entry = {"name": column, "file": f"{i}.npy"}
+        values = df[column]
+
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            entry["categories"] = values.cat.categories.tolist()
+            values = values.cat.codes
+
+        np.save(os.path.join(tmp_path, entry["file"]), values.to_numpy())
+        columns.append(entry)
+
+    with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+        json.dump({"source_hash": source_hash, "columns": columns}, f)
+
+    #Swap the finished snapshot in place
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp_path, path)
+
+
+def read_snapshot(name, source_hash, root):
+    """
+    :return: DataFrame backed by memory-mapped columns, None if the snapshot is missing or stale
+    """
+    path = root + SNAPSHOT_DIR + name
+
+    try:
+        with open(os.path.join(path, "manifest.json"), "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get("source_hash") != source_hash:
+        return None
+
+    columns = {}
+    for entry in manifest["columns"]:
+        values = np.load(os.path.join(path, entry["file"]), mmap_mode="r")
+        if "categories" in entry:
+            values = pd.Categorical.from_codes(values, categories=entry["categories"])
+        columns[entry["name"]] = values
+
+    return pd.DataFrame(columns, copy=False)
+
+
+def deployments_hash(root):
+    return file_hash(root + DEPLOYMENTS_SOURCE, extra=constants.country_colors)
+
+
+def load_deployments(root):
+    df = read_snapshot("deployments", deployments_hash(root), root)
+
+    #Fall back to the spreadsheet if the snapshot has not been built for the current data, and build it so that the
+    #next start (e.g. the first one after a deploy) reads the snapshot
+    if df is None:
+        df = prepare_deployments(pd.read_excel(root + DEPLOYMENTS_SOURCE))
+        try:
+            write_snapshot(df, "deployments", deployments_hash(root), root)
+        except OSError as e:
+            print(f"Could not save the deployments snapshot: {e}", flush=True)
+
+    return df
+
+
+def build_snapshots(root):
+    df = prepare_deployments(pd.read_excel(root + DEPLOYMENTS_SOURCE))
+    write_snapshot(df, "deployments", deployments_hash(root), root)
+    print("Saved deployments snapshot to " + SNAPSHOT_DIR)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    build_snapshots(os.getenv("PROJECT_ROOT"))
@@ -0,0 +1,114 @@
+import os
+
+import plotly.graph_objects as go
+import plotly.io as pio
+from dash_bootstrap_templates import load_figure_template
+
+from . import constants
+
+# litera is the default template of all figures
+load_figure_template("litera")
+
+# figures as plain dicts that dcc.Graph takes as they are, instead of graph_objects that validate every property,
+# MDI_RAW_FIGURES=0 for graph_objects. Both give the same figures (python -m util.benchmark raw_figures)
+raw_figures = os.getenv("MDI_RAW_FIGURES", "1") != "0"
+
+#Axis styling shared by the charts with axes
+axis = dict(
+    title_standoff=constants.theme["title_standoff"],
+    tickfont_size=constants.theme["tickfont_size"],
+)
+transparent = dict(paper_bgcolor="rgb(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)")
+
+
+# templates as plain dicts, shared by all raw figures so they must not be modified
+template_json = {}
+
+
+def register_template(name, layout):
+    """
+    Register a template derived from litera, validated once so that figures only have to reference it
+    :param layout: layout properties every figure of the chart type shares
+    :return: name of the template
+    """
+    template = go.layout.Template(pio.templates["litera"])
+    template.layout.update(layout)
+    pio.templates[name] = template
+    template_json[name] = template.to_plotly_json()
+    return name
+
+
+def figure(template, data=None, layout=None):
+    """
+    Figure with a registered template. Traces and layout are given as plain dicts without "_" shortcuts
+    (e.g. dict(title=dict(text=...)) and not title_text), so they can be used without validation
+    :param template: template name
+    :param data: list of trace dicts with their type
+    :param layout: layout properties of the figure on top of the template
+    :return: figure, its properties can be changed with fig["layout"]["height"] = ... either way
+    """
+    if raw_figures:
+        return {"data": list(data or []), "layout": dict(layout or {}, template=template_json[template])}
+    return go.Figure(data=data, layout=dict(layout or {}, template=pio.templates[template]))
+
+
+# Time series (line_chart)
+line_chart = register_template(
+    "mdi_line_chart",
+    dict(
+        yaxis=dict(axis, titlefont_size=constants.theme["titlefont_size"]),
+        xaxis=dict(axis, dtick=1),
+    ),
+)
+
+# Country time series with a label at the end of every line (dotted line and MDI plots)
+country_lines = register_template(
+    "mdi_country_lines",
+    dict(
+        transparent,
+        yaxis=dict(axis, titlefont_size=constants.theme["titlefont_size"], tickformat=","),
+        xaxis=dict(axis, dtick=1),
+        annotationdefaults=dict(xanchor="left", showarrow=False, font_size=constants.theme["titlefont_size"]),
+    ),
+)
+
+# Floating bars (horizontal_bar_plot)
+horizontal_bar = register_template(
+    "mdi_horizontal_bar",
+    dict(
+        transparent,
+        showlegend=False,
+        barmode="stack",
+        margin=dict(l=0, r=0, t=0, b=0, pad=20),
+        xaxis=dict(showticklabels=False, automargin=True, showgrid=False, visible=False),
+        yaxis=dict(automargin=True, showgrid=False),
+        annotationdefaults=dict(xref="x1", yref="y1", showarrow=False, xshift=15),
+    ),
+)
+
+# Meter plot
+meter = register_template(
+    "mdi_meter",
+    dict(
+        transparent,
+        margin=dict(l=0, r=0, t=1, b=0),
+        annotationdefaults=dict(x=0.49, y=0.45, font_size=15, showarrow=False),
+    ),
+)
+
+# Organisations bar plot (country_orgs_bar_plot)
+orgs_bar = register_template(
+    "mdi_orgs_bar",
+    dict(
+        transparent,
+        legend=dict(bgcolor="rgba(0,0,0,0)"),
+        xaxis=dict(axis, titlefont_size=constants.theme["titlefont_size"], ticksuffix="    "),
+        yaxis=dict(axis, titlefont_size=constants.theme["titlefont_size"], ticksuffix="     "),
+    ),
+)
+
+# Sunburst
+sunburst = register_template(
+    "mdi_sunburst",
+    dict(transparent, margin=dict(l=0, r=0, t=0, b=0)),
+)
@@ -1,15 +1,19 @@
+import os
+
+import numpy as np
 import pandas as pd
 
-from dash import Input, Output, State, exceptions
+from dash import Input, Output, State, ClientsideFunction, exceptions, no_update
 import plotly.graph_objects as go
 
 #Graph functions and styling
 from .server import app
-from . import constants, card_texts
+from . import constants, card_texts, templates
 from .plotting_functions import (
     horizontal_bar_plot,
     percentage_calculate,
     summary_graph_card,
+    modal_graph,
     meter_plot,
     country_orgs_bar_plot,
     comparison_summary_graph_card,
@@ -17,7 +21,86 @@ from .plotting_functions import (
 )
 
 # data
-from .app import df_deployments, df_presence, mapbox_access_token, ROOT
+from .app import df_deployments, df_presence, map_backend, mapbox_access_token
+from .data_store import store as data_store
+from .figure_cache import figure_cache
+from .cube import DeploymentCube
+from .country_ids import selection, sort_by_year_and_country
+
+# map with a single trace for deployments and presence (default) or a trace per country, MDI_MAP_SINGLE_TRACE=0
+map_single_trace = os.getenv("MDI_MAP_SINGLE_TRACE", "1") != "0"
+
+# markers of every zoom bucket (constants.map_zoom_levels) merged into grid cells of this many degrees, 0 merges the
+# points at the same theatre location, None draws every row. MDI_MAP_AGGREGATE=0 always draws every row
+map_aggregation = [10, 0, None]
+map_aggregate = os.getenv("MDI_MAP_AGGREGATE", "1") != "0"
+
+class YearPartitions:
+    """
+    Rows of a frame split by year, every year sorted by country id once.
+    """
+    def __init__(self, df):
+        df = sort_by_year_and_country(df)
+        self.empty = df.iloc[0:0]
+        self.years = {}
+        for year, dfy in df.groupby("Year"):
+            self.years[int(year)] = (dfy, dfy["CountryId"].to_numpy())
+
+    def select(self, year, countries):
+        """
+        :return: rows of the chosen countries in the year, sorted by country
+        """
+        if int(year) not in self.years:
+            return self.empty
+
+        dfy, country_ids = self.years[int(year)]
+        return dfy.iloc[np.flatnonzero(selection(countries)[country_ids])]
+
+
+# deployments and presence split by year for the map
+deployments_by_year = YearPartitions(df_deployments)
+presence_by_year = YearPartitions(df_presence)
+
+# deployments summed by country, year, organisation, theatre and mission for the cards
+deployments_cube = DeploymentCube(df_deployments)
+
+def aggregate_points(dfn, cell):
+    """
+    Merge map points into one marker per grid cell with the deployments summed
+    :param cell: grid cell size in degrees, 0 to merge the points at the same location
+    :return: frame with Lat, Lon and Color of the largest deployment in the cell, the summed Deployed, the Theatre(s)
+             and a Breakdown of the deployments by country for the hover
+    """
+    dfn = dfn.loc[:, ["Lat", "Lon", "Theatre", "Country", "Deployed", "Color"]].astype(
+        {"Theatre": "object", "Country": "object", "Color": "object"}
+    )
+    if cell:
+        dfn["Cell"] = list(zip(np.floor(dfn["Lat"] / cell), np.floor(dfn["Lon"] / cell)))
+    else:
+        dfn["Cell"] = list(zip(dfn["Lat"], dfn["Lon"]))
+
+    # contributors of every cell, largest first
+    contributors = dfn.groupby(["Cell", "Country"], sort=False)["Deployed"].sum().reset_index()
+    contributors = contributors.sort_values(by="Deployed", ascending=False, kind="stable")
+    contributors["Line"] = [
+        f"{country}: {deployed:,}" for country, deployed in zip(contributors.Country, contributors.Deployed)
+    ]
+    breakdown = contributors.groupby("Cell", sort=False)["Line"].agg("<br>".join)
+
+    cells = dfn.groupby("Cell", sort=False)
+    largest = dfn.loc[cells["Deployed"].idxmax()].set_index("Cell")
+
+    return pd.DataFrame(
+        {
+            "Lat": largest["Lat"],
+            "Lon": largest["Lon"],
+            "Color": largest["Color"],
+            "Deployed": cells["Deployed"].sum(),
+            "Theatre": cells["Theatre"].agg(lambda theatres: ", ".join(theatres.unique())),
+            "Breakdown": breakdown,
+        }
+    ).reset_index(drop=True)
+
 
 # default store
 selected_countries_default = pd.Series(
@@ -25,10 +108,22 @@ selected_countries_default = pd.Series(
         list(df_deployments.sort_values(by="Country").Country.unique()), True
     )
 )
-selected_year_default = pd.DataFrame(data={"year": [2021]})
 
 
-def update_map(selected_year, selected_countries, military_presence):
+def update_map(selected_year, selected_countries, military_presence, single_trace=None, zoom_bucket=None):
+    """
+    :param single_trace: one trace for all deployments (and one for presence) with per-point colours and sizes
+                         instead of one trace per country, MDI_MAP_SINGLE_TRACE setting if None
+    :param zoom_bucket: aggregate the markers for this zoom bucket (see map_aggregation), None to draw every row.
+                        Only used with a single trace
+    """
+    if single_trace is None:
+        single_trace = map_single_trace
+    cell = map_aggregation[zoom_bucket] if zoom_bucket is not None else None
+
+    # only the columns shown on hover are sent with the points
+    hover_columns = ["Country", "Theatre", "Deployed", "Organisation", "MissionName"]
+
     def get_data(dfn, name):
         data = go.Scattermapbox(
             name=name,
@@ -43,33 +138,61 @@ def update_map(selected_year, selected_countries, military_presence):
                 sizeref=20,
                 sizemin=2,
             ),
-            customdata=dfn,
-            hovertemplate="<b>Country: %{customdata[5]}</b><br>"
-            + "Theatre: %{customdata[2]} <br>"
-            + "Deployed: %{customdata[9]:,} <br>"
-            + "Command: %{customdata[6]} <br>"
-            + "Operation: %{customdata[7]} <br>"
+            customdata=dfn[hover_columns],
+            hovertemplate="<b>Country: %{customdata[0]}</b><br>"
+            + "Theatre: %{customdata[1]} <br>"
+            + "Deployed: %{customdata[2]:,} <br>"
+            + "Command: %{customdata[3]} <br>"
+            + "Operation: %{customdata[4]} <br>"
             + "<extra></extra>",
             showlegend=False,
         )
         return data
 
+    # the offline style has no sprite for the triangle symbol, presence is drawn as small opaque circles there
+    def presence_marker(color):
+        if map_backend == "mapbox":
+            return go.scattermapbox.Marker(allowoverlap=True, symbol="triangle", color=color)
+        return go.scattermapbox.Marker(allowoverlap=True, symbol="circle", color=color, size=6, opacity=1)
+
     def get_presence_data(dfn, name):
         data = go.Scattermapbox(
             name=name,
             lat=dfn.Lat,
             lon=dfn.Lon,
             mode="markers",
-            marker=go.scattermapbox.Marker(
-                allowoverlap=True,
-                symbol="triangle",
-                color=dfn.Color,
-            ),
-            customdata=dfn,
-            hovertemplate="<b>Country: %{customdata[5]}</b><br>"
-            + "Theatre: %{customdata[2]} <br>"
-            + "Deployed: %{customdata[9]} <br>"
-            + "Command: %{customdata[6]} <br>"
+            marker=presence_marker(dfn.Color),
+            meta="presence",
+            customdata=dfn[hover_columns[:4]],
+            hovertemplate="<b>Country: %{customdata[0]}</b><br>"
+            + "Theatre: %{customdata[1]} <br>"
+            + "Deployed: %{customdata[2]} <br>"
+            + "Command: %{customdata[3]} <br>"
+            + "<extra></extra>",
+            showlegend=False,
+        )
+        return data
+
+    def get_aggregated_data(dfn, name, presence=False):
+        dfa = aggregate_points(dfn, cell)
+        if presence:
+            marker = presence_marker(dfa.Color)
+        else:
+            marker = go.scattermapbox.Marker(
+                allowoverlap=True, color=dfa.Color, opacity=0.5, size=dfa.Deployed, sizeref=20, sizemin=2
+            )
+
+        data = go.Scattermapbox(
+            name=name,
+            lat=dfa.Lat,
+            lon=dfa.Lon,
+            mode="markers",
+            marker=marker,
+            meta="presence" if presence else None,
+            customdata=dfa[["Theatre", "Deployed", "Breakdown"]],
+            hovertemplate="<b>Theatre: %{customdata[0]}</b><br>"
+            + "Deployed: %{customdata[1]:,} <br>"
+            + "%{customdata[2]} <br>"
             + "<extra></extra>",
             showlegend=False,
         )
@@ -77,12 +200,20 @@ def update_map(selected_year, selected_countries, military_presence):
 
     hoverlabel = dict(font_size=16)
 
-    mapbox = dict(
-        accesstoken=mapbox_access_token,
-        center=dict(lat=24, lon=0),
-        zoom=1.5,
-        style="light",
-    )
+    if map_backend == "mapbox":
+        mapbox = dict(
+            accesstoken=mapbox_access_token,
+            center=dict(lat=24, lon=0),
+            zoom=1.5,
+            style="light",
+        )
+    else:
+        # plain background, the markers are drawn without any tiles
+        mapbox = dict(
+            center=dict(lat=24, lon=0),
+            zoom=1.5,
+            style="white-bg",
+        )
 
     layout = dict(
         title="",
@@ -96,31 +227,43 @@ def update_map(selected_year, selected_countries, military_presence):
         plot_bgcolor="rgba(0,0,0,0)",
     )
 
-    query = "Country in @selected_countries & Year == @selected_year"
-
-    # filter and sort
-    dfp = df_deployments.query(query).sort_values(by="Country")
+    # filter, rows are already sorted by country
+    dfp = deployments_by_year.select(selected_year, selected_countries)
 
-    dfp_presence = df_presence.query(query).sort_values(by="Country")
+    dfp_presence = presence_by_year.select(selected_year, selected_countries)
 
     # generate
-    data = [
-        get_data(
-            dfp.loc[(dfp["Country"] == country)],
-            country,
-        )
-        for country in dfp["Country"].unique()
-    ]
+    if single_trace and cell is not None:
+        data = [get_aggregated_data(dfp, "Deployments")] if not dfp.empty else []
 
-    if military_presence:
-        data = data + [
-            get_presence_data(
-                dfp_presence.loc[(dfp_presence["Country"] == country)],
+        if military_presence and not dfp_presence.empty:
+            data = data + [get_aggregated_data(dfp_presence, "Military presence", presence=True)]
+
+    elif single_trace:
+        # points stay in the same order, so the drawing order is the same as with a trace per country
+        data = [get_data(dfp, "Deployments")] if not dfp.empty else []
+
+        if military_presence and not dfp_presence.empty:
+            data = data + [get_presence_data(dfp_presence, "Military presence")]
+
+    else:
+        data = [
+            get_data(
+                dfp.loc[(dfp["Country"] == country)],
                 country,
             )
-            for country in dfp_presence["Country"].unique()
+            for country in dfp["Country"].unique()
         ]
 
+        if military_presence:
+            data = data + [
+                get_presence_data(
+                    dfp_presence.loc[(dfp_presence["Country"] == country)],
+                    country,
+                )
+                for country in dfp_presence["Country"].unique()
+            ]
+
     figure = go.Figure(
         data=data,
         layout=layout,
@@ -129,64 +272,60 @@ def update_map(selected_year, selected_countries, military_presence):
     return figure
 
 
-def update_line_plot(dfp):
-    def get_data(dfn, name):
-        dfg = dfn.groupby(["Year"])["Deployed"].sum()
-        data = go.Scatter(
+def map_figure(selected_year, selected_countries, zoom_bucket=0):
+    #Cached map figure as a plain dict, shared between requests so it must not be modified. Presence layer is always
+    #included, its visibility is switched in the browser
+    countries = tuple(sorted(set(selected_countries or [])))
+    zoom_bucket = int(zoom_bucket or 0) if map_aggregate else None
+    return figure_cache.get_or_compute(
+        ("map", countries, int(selected_year), zoom_bucket),
+        data_store.refresh(),
+        lambda: update_map(selected_year, list(countries), True, zoom_bucket=zoom_bucket).to_plotly_json(),
+    )
+
+
+#Country name at the end of each line, in the colour of the line
+def line_annotations(data):
+    return [
+        dict(
+            x=np.asarray(trace["x"])[-1] + 0.1,
+            y=np.asarray(trace["y"])[-1],
+            text=trace["name"],
+            font=dict(color=trace["line"]["color"]),
+        )
+        for trace in data
+    ]
+
+
+def update_line_plot(deployed_by_year, country_list):
+    def get_data(dfg, name):
+        data = dict(
+            type="scatter",
             x=dfg.index,
             y=dfg.values,
             name=name,
             showlegend=False,
-            line=dict(color=dfn.Color.iloc[0]),
+            line=dict(color=constants.country_colors[name]),
             hovertemplate=f"<b>Country: {name}</b><br>"
             + "Deployed: %{y:,}"
             + "<extra></extra>",
         )
         return data
-    #List of countries
-    country_list = dfp["Country"].unique()
-
     data = [
-        get_data(dfp[dfp["Country"] == country], country)
+        get_data(deployed_by_year.loc[country], country)
         for country in country_list
     ]
 
-    #Make figure
-    figure = go.Figure(data=data)
-    figure.update_layout(
-        margin=dict(l=90, r=0, t=0, b=0),
-        height=340,
-        paper_bgcolor="rgb(0,0,0,0)",
-        plot_bgcolor="rgba(0,0,0,0)",
-        yaxis_title="Deployed",
-        yaxis_title_standoff=90,
-        yaxis_tickformat=",",
-    )
-
-    figure.update_yaxes(
-        title_standoff=constants.theme["title_standoff"],
-        tickfont_size=constants.theme["tickfont_size"],
-        titlefont_size=constants.theme["titlefont_size"],
-    )
-    figure.update_xaxes(
-        title_standoff=constants.theme["title_standoff"],
-        tickfont_size=constants.theme["tickfont_size"],
-        dtick=1,
-    )
-
-    #Add annotation for each line
-    figure.for_each_trace(
-        lambda f: figure.add_annotation(
-            x=f.x[-1] + 0.1,
-            y=f.y[-1],
-            text=f.name,
-            font_color=f.line.color,
-            xanchor="left",
-            showarrow=False,
-            font_size=constants.theme["titlefont_size"],
-        )
-        if f.name in country_list
-        else None
+    #Make figure with an annotation at the end of each line
+    figure = templates.figure(
+        templates.country_lines,
+        data=data,
+        layout=dict(
+            margin=dict(l=90, r=0, t=0, b=0),
+            height=340,
+            yaxis=dict(title=dict(text="Deployed")),
+            annotations=line_annotations(data),
+        ),
     )
 
     #Make a card
@@ -200,25 +339,25 @@ def update_line_plot(dfp):
     return card
 
 
-def update_sunburst_plot(dfp):
-    #Filter numbers by organisations and mission
-    dfm = dfp.groupby(["Organisation", "MissionName"])["Deployed"].sum()
-    dfm = dfm.to_frame().reset_index()
+def update_sunburst_plot(deployed_by_mission, country_list):
+    #Numbers by organisations and mission
+    dfm = deployed_by_mission.to_frame().reset_index()
 
-    dfo = dfp.groupby(["Organisation"])["Deployed"].sum()
+    dfo = deployed_by_mission.groupby(level="Organisation").sum()
 
     #List of orgs
     orgs = list(dfm.Organisation.unique())
 
     #Make a plot
-    data = go.Sunburst(
+    data = dict(
+        type="sunburst",
         ids=orgs
         + [x + y for x, y in zip(list(dfm.Organisation), list(dfm.MissionName))],
         labels=orgs + list(dfm.MissionName),
         parents=[""] * len(orgs) + list(dfm.Organisation),
         values=list(dfo) + list(dfm.Deployed),
         branchvalues="total",
-        marker=go.sunburst.Marker(
+        marker=dict(
             colors=[
                 constants.organisation_colors.get(
                     org,
@@ -235,16 +374,11 @@ def update_sunburst_plot(dfp):
         + "Share: %{percentParent:.3p}<br>"
         + "<extra></extra>",
     )
-    figure = go.Figure(data=data)
-    figure.update_layout(
-        margin=dict(l=0, r=0, t=0, b=0),
-        paper_bgcolor="rgb(0,0,0,0)",
-        plot_bgcolor="rgba(0,0,0,0)",
-    )
+    figure = templates.figure(templates.sunburst, data=[data])
 
     #Change subtitle if only one country selected
-    if len(dfp["Country"].unique()) == 1:
-        card_under_title = f"FOR {dfp['Country'].unique()[0]}"
+    if len(country_list) == 1:
+        card_under_title = f"FOR {country_list[0]}"
     else:
         card_under_title = card_texts.sbp_under_title
 
@@ -268,7 +402,7 @@ def update_population_plot(df_deployment_capita):
         df_top_5 = df.head(5)
         condensed = True
 
-        # Create figures also in modal
+        # All countries are in the modal
         fig = horizontal_bar_plot(
             df_top_5["Deployment Per Capita"].iloc[::-1].values,
             df_top_5["Country Name"].iloc[::-1].values,
@@ -276,13 +410,6 @@ def update_population_plot(df_deployment_capita):
             20,
         )
 
-        full_graph = horizontal_bar_plot(
-            df["Deployment Per Capita"].iloc[::-1].values,
-            df["Country Name"].iloc[::-1].values,
-            df["Deployment Per Capita"].iloc[::-1].values,
-            20,
-        )
-
         modal_id = "population"
 
     else:
@@ -295,16 +422,14 @@ def update_population_plot(df_deployment_capita):
             20,
         )
 
-        full_graph = None
-
         modal_id = None
 
     # Create a card
     #Graph height to level out cards in one row
     if df.shape[0] == 1:
-        fig.update_layout(height=134)
+        fig["layout"]["height"] = 134
     else:
-        fig.update_layout(height=164)
+        fig["layout"]["height"] = 164
 
     card = summary_graph_card(
         card_texts.dpc_under_title,
@@ -312,30 +437,32 @@ def update_population_plot(df_deployment_capita):
         card_texts.dpc_info_circle,
         fig,
         modal_id=modal_id,
-        full_graph=full_graph,
+        expand=modal_id is not None,
     )
     return card
 
 
+def population_full_graph(df_deployment_capita):
+    #Graph of all countries in the modal
+    df = df_deployment_capita.sort_values(by=["Deployment Per Capita"], ascending=False)
+
+    return horizontal_bar_plot(
+        df["Deployment Per Capita"].iloc[::-1].values,
+        df["Country Name"].iloc[::-1].values,
+        df["Deployment Per Capita"].iloc[::-1].values,
+        20,
+    )
+
+
 def update_active_plot(df_active_personnel):
     #Sort data
     df = df_active_personnel.sort_values(by=["Percent of Active Personnel"], ascending=False)
 
     #Graph in modal (only if more than 5 countries selected)
-    full_graph = None
     modal_id = None
 
     # If more than 5 countries, select top 5
     if df.shape[0] > 5:
-
-        full_graph = horizontal_bar_plot(
-            df["Percent of Active Personnel"].iloc[::-1].values,
-            df["Country Name"].iloc[::-1].values,
-            df["Percent of Active Personnel"].iloc[::-1].values,
-            100,
-            percentage=True,
-        )
-
         modal_id = "active"
 
     df = df.head(5)
@@ -351,9 +478,9 @@ def update_active_plot(df_active_personnel):
     # Create a card
     #Graph height to level out cards in one row
     if df.shape[0] == 1:
-        fig.update_layout(height=134)
+        fig["layout"]["height"] = 134
     else:
-        fig.update_layout(height=164)
+        fig["layout"]["height"] = 164
 
     card = summary_graph_card(
         card_texts.dap_under_title,
@@ -361,16 +488,29 @@ def update_active_plot(df_active_personnel):
         card_texts.dap_info_circle,
         fig,
         modal_id=modal_id,
-        full_graph=full_graph,
+        expand=modal_id is not None,
     )
     return card
 
 
-def update_deployed_meter_plot(df_deploy, df_deploy_all_years):
-    #Group by theatre and calculate total deployment for each theatre
-    df = df_deploy.groupby(["Theatre"])["Deployed"].sum().to_frame()
+def active_full_graph(df_active_personnel):
+    #Graph of all countries in the modal
+    df = df_active_personnel.sort_values(by=["Percent of Active Personnel"], ascending=False)
+
+    return horizontal_bar_plot(
+        df["Percent of Active Personnel"].iloc[::-1].values,
+        df["Country Name"].iloc[::-1].values,
+        df["Percent of Active Personnel"].iloc[::-1].values,
+        100,
+        percentage=True,
+    )
+
+
+def update_deployed_meter_plot(deployed_by_theatre, country_list):
+    #Total deployment for each theatre
+    df = deployed_by_theatre.to_frame()
     #Total deployment for all theatres
-    total_deployed = df_deploy["Deployed"].sum()
+    total_deployed = deployed_by_theatre.sum()
 
     #Deployment percentage for each theatre compared to total deployment
     df["Percentage"] = df/ total_deployed * 100
@@ -384,12 +524,10 @@ def update_deployed_meter_plot(df_deploy, df_deploy_all_years):
     fig = meter_plot(highest_percentage, df["Deployed"].max(), {"min": 0, "max": 100})
 
     #Graph height to level out cards in one row
-    if df_deploy["Country"].unique().shape[0] == 1:
-        fig.update_layout(height=134)
+    if len(country_list) == 1:
+        fig["layout"]["height"] = 134
     else:
-        fig.update_layout(height=164)
-
-    #Create a figure to put inside the modal
+        fig["layout"]["height"] = 164
 
     #TODO: MAYBE I'LL USE IT LATER - keep for time series purposes, delete later if not used
     #Query deployment to the top theatre, groups deployment by years and sum total deployment for each year
@@ -402,7 +540,6 @@ def update_deployed_meter_plot(df_deploy, df_deploy_all_years):
     #               "y_label": "Total deployment",
     #               "colour":constants.red}
     #fig_modal = line_chart([figure_dict])
-    fig_modal = horizontal_bar_plot(df["Percentage"], df.index, df["Deployed"], highest_percentage, percentage=False)
 
     card = summary_graph_card(
         df["Percentage"].idxmax(),
@@ -410,25 +547,21 @@ def update_deployed_meter_plot(df_deploy, df_deploy_all_years):
         card_texts.tdm_info_circle,
         fig,
         modal_id="top-theatre",
-        full_graph=fig_modal,
+        expand=True,
         title_colour_highlighted=True
     )
 
     return card
 
 
-def update_two_deployment_meter_plots(df_deploy):
+def update_two_deployment_meter_plots(deployed_by_theatre, country_list):
     top_theatres = []
 
-    for country in df_deploy["Country"].unique():
+    for country in country_list:
+        #Deployments for each theatre
+        country_theatres = deployed_by_theatre.loc[country]
         #Calculate total deployment
-        total_deployed = df_deploy.query("Country == @country")["Deployed"].sum()
-        #Calculate deployments for each theatre
-        country_theatres = (
-            df_deploy.query("Country == @country")
-            .groupby(["Theatre"])["Deployed"]
-            .sum()
-        )
+        total_deployed = country_theatres.sum()
         #Find top theatre and its percentual contribution
         top_theatre = country_theatres[country_theatres == country_theatres.max()]
         top_theatre_percentage = percentage_calculate(
@@ -444,7 +577,7 @@ def update_two_deployment_meter_plots(df_deploy):
         )
 
         # Graph height to level out cards in one row
-        fig.update_layout(height=164)
+        fig["layout"]["height"] = 164
 
         top_theatres.append(
             {
@@ -455,11 +588,17 @@ def update_two_deployment_meter_plots(df_deploy):
                 "Graph": fig,
             }
         )
-    # Making a modal plot
-    # Group by theatre and calculate total deployment for each theatre
-    df = df_deploy.groupby(["Theatre"])["Deployed"].sum().to_frame()
+    #Make card
+    card = comparison_summary_graph_card(top_theatres[0], top_theatres[1], card_info=card_texts.tdm_info_circle,
+                                         expand=True, modal_id="top-theatre")
+    return card
+
+
+def theatre_full_graph(deployed_by_theatre):
+    # Total deployment for each theatre
+    df = deployed_by_theatre.to_frame()
     # Total deployment for all theatres
-    total_deployed = df_deploy["Deployed"].sum()
+    total_deployed = deployed_by_theatre.sum()
 
     # Deployment percentage for each theatre compared to total deployment
     df["Percentage"] = df / total_deployed * 100
@@ -468,16 +607,14 @@ def update_two_deployment_meter_plots(df_deploy):
     # Theatre with the highest percentage deployment
     highest_percentage = df["Percentage"].max()
 
-    fig_modal = horizontal_bar_plot(df["Percentage"], df.index, df["Deployed"], highest_percentage, percentage=False)
-
-    #Make card
-    card = comparison_summary_graph_card(top_theatres[0], top_theatres[1], card_info=card_texts.tdm_info_circle,
-                                         full_graph=fig_modal, modal_id="top-theatre")
-    return card
+    return horizontal_bar_plot(df["Percentage"], df.index, df["Deployed"], highest_percentage, percentage=False)
 
 
-def update_total_deployment_plot(df_deployment_top_org):
-
+def top_orgs_with_other(df_deployment_top_org):
+    """
+    :return: deployments by organisation with the organisations outside the top 5 as "Other", sorted by deployment,
+             and the total deployment of every country sorted from the highest
+    """
     country_deployment_sum = (df_deployment_top_org.groupby(["Country"])["Deployed"].sum().sort_values(ascending=False))
     df_deployment_top_org = df_deployment_top_org.sort_values(by="Deployed", ascending=False)
 
@@ -496,29 +633,32 @@ def update_total_deployment_plot(df_deployment_top_org):
                                   "Organisation"] = "Other"
 
     df_deployment_top_org = df_deployment_top_org.sort_values(by="Deployed", ascending=False)
+    return df_deployment_top_org, country_deployment_sum
+
+
+def update_total_deployment_plot(df_deployment_top_org):
+    df_deployment_top_org, country_deployment_sum = top_orgs_with_other(df_deployment_top_org)
+
     # If more than 5 countries create a card with modal where you can see all countries
     if len(df_deployment_top_org["Country"].unique()) > 5:
         country_list = list(country_deployment_sum.head(5).index)
-        df_top_5 = df_deployment_top_org.query("Country in @country_list")
+        df_top_5 = df_deployment_top_org[selection(country_list)[df_deployment_top_org["CountryId"]]]
         condensed = True
 
         # Create figures also in modal
         fig = country_orgs_bar_plot(
             df_top_5, country_order=country_list, condensed=condensed
         )
-        #Graph containing all coutnries
-        full_graph = country_orgs_bar_plot(df_deployment_top_org, country_order=country_deployment_sum.index)
 
         modal_id = "total-deployment"
 
     else:
         # Create only page figure, ignore modal
         fig = country_orgs_bar_plot(df_deployment_top_org, country_order=country_deployment_sum.index)
-        modal_id = (None,)
-        full_graph = None
+        modal_id = None
 
     # Update figure height and create a card
-    fig.update_layout(height=250)
+    fig["layout"]["height"] = 250
 
     #Change card subtitle if only one country selected
     if len(df_deployment_top_org["Country"].unique()) == 1:
@@ -534,19 +674,25 @@ def update_total_deployment_plot(df_deployment_top_org):
         card_texts.tdop_info_circle,
         fig,
         modal_id=modal_id,
-        full_graph=full_graph,
+        expand=modal_id is not None,
     )
     return card
 
 
-def update_orgs_bar_plot(df_deploy):
+def total_deployment_full_graph(df_deployment_top_org):
+    #Graph containing all coutnries
+    df_deployment_top_org, country_deployment_sum = top_orgs_with_other(df_deployment_top_org)
+    return country_orgs_bar_plot(df_deployment_top_org, country_order=country_deployment_sum.index)
+
+
+def update_orgs_bar_plot(deployed_by_organisation):
     #Calculate total deployment
-    total_deployed = df_deploy["Deployed"].sum()
+    total_deployed = deployed_by_organisation.sum()
 
     # Query top 5 organisations, rest goes under other
     top_orgs = (
-        df_deploy.groupby(["Organisation"])
-        .sum()
+        deployed_by_organisation
+        .to_frame()
         .sort_values(by="Deployed", ascending=False)
         .head(5)
     )
@@ -556,7 +702,7 @@ def update_orgs_bar_plot(df_deploy):
     deployed_names_orgs = list(top_orgs.index)
 
     #If more than 5 orgs, rest goes under other
-    if len(df_deploy["Organisation"].unique()) > 5:
+    if len(deployed_by_organisation) > 5:
         deployed_names_orgs.append("Other")
         other_orgs = total_deployed - top_orgs["Deployed"].sum()
         deployed_numbers.append(other_orgs)
@@ -589,7 +735,7 @@ def update_orgs_bar_plot(df_deploy):
         percentage=True,
         colour=colours[::-1],
     )
-    fig.update_layout(height=137)
+    fig["layout"]["height"] = 137
     #summary_graph_card
     card = summary_graph_card(
         "{:,}".format(total_deployed),
@@ -603,7 +749,8 @@ def update_orgs_bar_plot(df_deploy):
 
 def update_mdi_plot(mdi):
     def get_data(dfn, name):
-        data = go.Scatter(
+        data = dict(
+            type="scatter",
             x=dfn["Year"],
             y=dfn["MDI"],
             name=name,
@@ -614,49 +761,22 @@ def update_mdi_plot(mdi):
             + "<extra></extra>",
         )
         return data
-    #Get all countries
-    country_list = mdi["Country"].unique()
-
-    #Make the mdi summary figure
+    #Make the mdi summary figure, one line per country in the order of the table
     data = [
-        get_data(mdi.query("Country== @country"), country)
-        for country in country_list
+        get_data(dfn, country)
+        for country, dfn in mdi.groupby("Country", sort=False)
     ]
 
-    figure = go.Figure(data=data)
-    figure.update_layout(
-        margin=dict(l=50, r=0, t=0, b=0),
-        height=340,
-        paper_bgcolor="rgb(0,0,0,0)",
-        plot_bgcolor="rgba(0,0,0,0)",
-        yaxis_title="MDI",
-        yaxis_title_standoff=30,
-        yaxis_tickformat=",",
-    )
-    figure.update_yaxes(
-        title_standoff=constants.theme["title_standoff"],
-        tickfont_size=constants.theme["tickfont_size"],
-        titlefont_size=constants.theme["titlefont_size"],
-    )
-    figure.update_xaxes(
-        title_standoff=constants.theme["title_standoff"],
-        tickfont_size=constants.theme["tickfont_size"],
-        dtick=1,
-    )
-
-    #Add annotation to each line
-    figure.for_each_trace(
-        lambda f: figure.add_annotation(
-            x=f.x[-1] + 0.1,
-            y=f.y[-1],
-            text=f.name,
-            font_color=f.line.color,
-            xanchor="left",
-            showarrow=False,
-            font_size=constants.theme["titlefont_size"],
-        )
-        if f.name in country_list
-        else None
+    #Make the mdi figure with an annotation at the end of each line
+    figure = templates.figure(
+        templates.country_lines,
+        data=data,
+        layout=dict(
+            margin=dict(l=50, r=0, t=0, b=0),
+            height=340,
+            yaxis=dict(title=dict(text="MDI")),
+            annotations=line_annotations(data),
+        ),
     )
 
     card = summary_graph_card(
@@ -669,113 +789,201 @@ def update_mdi_plot(mdi):
     return card
 
 
-def update_dashboard(selected_countries, year):
-    #Load data
-    #Deployments data
-    dfp = df_deployments
-    #MDI values for all countries and years
-    df_mdi = pd.read_csv(ROOT + "data/mdi.csv", delimiter=",")
-    #Active personnel data for all countries and years
-    df_active_personnel = pd.read_csv(ROOT + "data/active_personnel.csv", delimiter=",")
-    #Deployments per capita for all countries and years
-    df_deployment_capita = pd.read_csv(ROOT + "data/deployment_per_capita.csv", delimiter=",")
-    #Top oragnisations for each country per year
-    df_deployment_top_org = pd.read_csv(ROOT + "data/top_organisations.csv", delimiter=",")
-
-    if not selected_countries:
-        raise exceptions.PreventUpdate
-
-    #Query data based on chosen countries and year
-    dfp = dfp.query("Country in @selected_countries")
-    df_active_personnel = df_active_personnel.query("Country in @selected_countries & Year == @year")
-    df_deployment_capita = df_deployment_capita.query("Country in @selected_countries & Year == @year")
-    df_deployment_top_org = df_deployment_top_org.query("Country in @selected_countries & Year == @year")
-    df_mdi = df_mdi.query("Country in @selected_countries")
-    dfp_year = dfp[dfp["Year"] == int(year)]
-
-    #Get all cards inside the layout
-    deployments_over_time_card = update_line_plot(dfp)
-    sunburst_card = update_sunburst_plot(dfp_year)
-    population_card = update_population_plot(df_deployment_capita)
-    active_card = update_active_plot(df_active_personnel)
-    deploy_meter_card = update_deployed_meter_plot(dfp_year, dfp)
-    orgs_countries_card = update_total_deployment_plot(df_deployment_top_org)
-    orgs_bar_card = update_orgs_bar_plot(dfp_year)
-    mdi_card = update_mdi_plot(df_mdi)
+def update_theatre_plot(selected_countries, year):
+    country_list = deployments_cube.countries(selected_countries, year)
 
     #If 2 countries use comparison meter plots
     if len(selected_countries) == 2:
-        return (
-            deployments_over_time_card,
-            sunburst_card,
-            population_card,
-            active_card,
-            update_two_deployment_meter_plots(dfp_year),
-            orgs_countries_card,
-            orgs_bar_card,
-            mdi_card,
+        return update_two_deployment_meter_plots(
+            deployments_cube.sum(selected_countries, year, by=["Country", "Theatre"]), country_list
         )
 
+    return update_deployed_meter_plot(deployments_cube.sum(selected_countries, year, by="Theatre"), country_list)
+
+
+# Dashboard cards keyed by the id of the card in the layout. Every card declares the stores it depends on, so that
+# cards which only depend on the countries are not rebuilt when the year slider moves.
+countries_input = ["selected-countries"]
+countries_year_inputs = ["selected-countries", "selected-year"]
+
+cards = {
+    "card-line": {
+        "inputs": countries_input,
+        "build": lambda countries, year: update_line_plot(
+            deployments_cube.sum(countries, by=["Country", "Year"]), deployments_cube.countries(countries)
+        ),
+    },
+    "card-sunburst": {
+        "inputs": countries_year_inputs,
+        "build": lambda countries, year: update_sunburst_plot(
+            deployments_cube.sum(countries, year, by=["Organisation", "MissionName"]),
+            deployments_cube.countries(countries, year),
+        ),
+    },
+    "card-population": {
+        "inputs": countries_year_inputs,
+        "build": lambda countries, year: update_population_plot(data_store.deployment_per_capita(countries, year)),
+    },
+    "card-active": {
+        "inputs": countries_year_inputs,
+        "build": lambda countries, year: update_active_plot(data_store.active_personnel(countries, year)),
+    },
+    "card-theatre": {
+        "inputs": countries_year_inputs,
+        "build": update_theatre_plot,
+    },
+    "card-countries-orgs": {
+        "inputs": countries_year_inputs,
+        "build": lambda countries, year: update_total_deployment_plot(data_store.top_organisations(countries, year)),
+    },
+    "card-bar-orgs": {
+        "inputs": countries_year_inputs,
+        "build": lambda countries, year: update_orgs_bar_plot(
+            deployments_cube.sum(countries, year, by="Organisation")
+        ),
+    },
+    "card-mdi": {
+        "inputs": countries_input,
+        "build": lambda countries, year: update_mdi_plot(data_store.mdi(countries)),
+    },
+}
+
+
+def update_card(card_id, selected_countries, year=None):
+    if not selected_countries:
+        raise exceptions.PreventUpdate
+
+    #Cache key is the canonical country selection (and year), cache is dropped when data files are reloaded
+    countries = tuple(sorted(set(selected_countries)))
+    if "selected-year" in cards[card_id]["inputs"]:
+        year = int(year)
+        key = ("card", card_id, countries, year)
     else:
-        return (
-            deployments_over_time_card,
-            sunburst_card,
-            population_card,
-            active_card,
-            deploy_meter_card,
-            orgs_countries_card,
-            orgs_bar_card,
-            mdi_card,
-        )
+        year = None
+        key = ("card", card_id, countries)
 
+    return figure_cache.get_or_compute(
+        key,
+        data_store.refresh(),
+        lambda: cards[card_id]["build"](list(countries), year),
+    )
+
+
+# Graphs of the modals keyed by the modal id, built when the expand button of the modal is clicked
+modals = {
+    "population": lambda countries, year: population_full_graph(data_store.deployment_per_capita(countries, year)),
+    "active": lambda countries, year: active_full_graph(data_store.active_personnel(countries, year)),
+    "top-theatre": lambda countries, year: theatre_full_graph(deployments_cube.sum(countries, year, by="Theatre")),
+    "total-deployment": lambda countries, year: total_deployment_full_graph(
+        data_store.top_organisations(countries, year)
+    ),
+}
+
+
+def update_modal(modal_id, selected_countries, year):
+    if not selected_countries:
+        raise exceptions.PreventUpdate
+
+    countries = tuple(sorted(set(selected_countries)))
+    return figure_cache.get_or_compute(
+        ("modal", modal_id, countries, int(year)),
+        data_store.refresh(),
+        lambda: modal_graph(modals[modal_id](list(countries), int(year))),
+    )
+
+
+def update_dashboard(selected_countries, year):
+    return tuple(update_card(card_id, selected_countries, year) for card_id in cards)
 
-@app.callback(
-    Output(component_id="card-line", component_property="children"),
-    Output(component_id="card-sunburst", component_property="children"),
-    Output(component_id="card-population", component_property="children"),
-    Output(component_id="card-active", component_property="children"),
-    Output(component_id="card-theatre", component_property="children"),
-    Output(component_id="card-countries-orgs", component_property="children"),
-    Output(component_id="card-bar-orgs", component_property="children"),
-    Output(component_id="card-mdi", component_property="children"),
-    Input(component_id="selected-countries", component_property="data"),
-    Input(component_id="selected-year", component_property="data"),
-)
-def reload_dashboard(selected_countries, selected_year):
-    selected_year = pd.read_json(selected_year)["year"].iloc[0]
 
-    return update_dashboard(selected_countries, selected_year)
+# Every card has its own callback with only the inputs it depends on, so cards are requested (and rendered)
+# independently of each other
+def register_card_callback(card_id):
+    inputs = cards[card_id]["inputs"]
+
+    @app.callback(
+        Output(component_id=card_id, component_property="children"),
+        [Input(component_id=store, component_property="data") for store in inputs],
+    )
+    def reload_card(selected_countries, selected_year=None):
+        return update_card(card_id, selected_countries, selected_year)
+
+    return reload_card
+
+
+for card_id in cards:
+    register_card_callback(card_id)
+
+
+def register_modal_callback(modal_id):
+    @app.callback(
+        Output(component_id=f"expand-{modal_id}-md", component_property="children"),
+        Input(component_id=f"expand_{modal_id}", component_property="n_clicks"),
+        State(component_id="selected-countries", component_property="data"),
+        State(component_id="selected-year", component_property="data"),
+    )
+    def load_modal(n_clicks, selected_countries, selected_year):
+        if not n_clicks:
+            raise exceptions.PreventUpdate
+        return update_modal(modal_id, selected_countries, selected_year)
+
+    return load_modal
+
+
+for modal_id in modals:
+    register_modal_callback(modal_id)
 
 
 @app.callback(
     Output(component_id="selected-year", component_property="data"),
-    Output(component_id="graph-map", component_property="figure"),
+    Output(component_id="map-figure", component_property="data"),
     Output(component_id="selected-countries", component_property="data"),
     Input(component_id="year-slider", component_property="value"),
     Input(component_id="country-filter", component_property="value"),
-    Input(component_id="military-presence-switch", component_property="value"),
-    State(component_id="graph-map", component_property="relayoutData"),
+    Input(component_id="map-zoom-bucket", component_property="data"),
+    State(component_id="selected-year", component_property="data"),
+    State(component_id="selected-countries", component_property="data"),
 )
-def update_filters(actual_year, country_selection, military_presence, data):
-    zoom = 1.5
-    center = dict(lat=24, lon=0)
-    if data:
-        zoom = data.get("mapbox.zoom", 1.5)
-        center = data.get("mapbox.center", dict(lat=24, lon=0))
+def update_filters(actual_year, country_selection, zoom_bucket=0, stored_year=None, stored_countries=None):
+    figure = map_figure(actual_year, country_selection, zoom_bucket)
 
-    figure = update_map(actual_year, country_selection, military_presence)
-    figure.update_layout(mapbox_zoom=zoom, mapbox_center=center)
+    #Year store holds the year as a plain integer
+    selected_year = int(actual_year)
 
-    selected_year = selected_year_default
-    selected_year["year"].iloc[0] = actual_year
+    #Only update the stores that changed, so that cards which do not depend on them are not rebuilt
+    if selected_year == stored_year:
+        selected_year = no_update
+    if country_selection == stored_countries:
+        country_selection = no_update
 
     return (
-        selected_year.to_json(),
+        selected_year,
         figure,
         country_selection,
     )
 
 
+# Presence layer visibility and zoom/center of the map are applied in the browser (assets/map.js), the server only
+# sends a new figure when the year, the countries or the zoom bucket change
+app.clientside_callback(
+    ClientsideFunction(namespace="map", function_name="render"),
+    Output(component_id="graph-map", component_property="figure"),
+    Input(component_id="map-figure", component_property="data"),
+    Input(component_id="military-presence-switch", component_property="value"),
+    State(component_id="graph-map", component_property="relayoutData"),
+)
+
+# Zoom bucket of the map, changes (and makes the server aggregate the markers differently) only when the zoom crosses
+# one of constants.map_zoom_levels
+app.clientside_callback(
+    ClientsideFunction(namespace="map", function_name="zoomBucket"),
+    Output(component_id="map-zoom-bucket", component_property="data"),
+    Input(component_id="graph-map", component_property="relayoutData"),
+    State(component_id="map-zoom-levels", component_property="data"),
+    State(component_id="map-zoom-bucket", component_property="data"),
+)
+
+
 # Population expand graph
 @app.callback(
     Output("full-population-graph", "is_open"),
@@ -0,0 +1,50 @@
+import threading
+import time
+
+from . import constants
+from .app import df
+from .update_functions import update_dashboard, map_figure
+
+
+# Trade-off of the gunicorn setup (gunicorn.conf.py): with preload_app the master warms before forking, so the cache
+# is rendered once and shared by every worker, but the workers only accept requests after it. The master stops after
+# MDI_WARMUP_BUDGET seconds and the workers warm the remaining views in the background with start_warmup
+
+
+def warm_cache(years=None, budget=None):
+    """
+    Render the dashboard and map of the preset country selections (all, NATO, EU) for every year of the slider
+    into the figure cache. Views already in the cache are not rendered again.
+    :param budget: seconds after which the remaining views are left out, None for no limit
+    :return: True if every view was warmed
+    """
+    start = time.perf_counter()
+
+    if years is None:
+        years = sorted(df["Year"].unique())
+
+    selections = [
+        list(constants.country_regions.keys()),
+        constants.nato_countries,
+        constants.eu_countries,
+    ]
+
+    views = [(year, countries) for year in years for countries in selections]
+    warmed = 0
+    for year, countries in views:
+        if budget is not None and time.perf_counter() - start > budget:
+            break
+        update_dashboard(countries, year)
+        map_figure(year, countries)
+        warmed += 1
+
+    elapsed = time.perf_counter() - start
+    print(f"Warmed figure cache with {warmed} of {len(views)} views in {elapsed:.1f} s", flush=True)
+    return warmed == len(views)
+
+
+def start_warmup():
+    #Warm in the background so that the worker accepts requests immediately
+    thread = threading.Thread(target=warm_cache, name="figure-cache-warmup", daemon=True)
+    thread.start()
+    return thread
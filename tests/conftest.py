@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The app reads its data relative to PROJECT_ROOT
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + "/"
+os.environ.setdefault("PROJECT_ROOT", ROOT)
+sys.path.insert(0, ROOT)
@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from mdi import constants
+from mdi.app import app
+from mdi.figure_cache import figure_cache
+from util.benchmark import callback_payload, card_inputs
+
+# Callbacks served concurrently by the threads of a worker, like gunicorn gthread workers do
+
+
+@pytest.fixture
+def client():
+    #Every request renders, the cached figures would hide a callback using the year of another request
+    size = figure_cache.size
+    figure_cache.size = 0
+    yield app.server.test_client()
+    figure_cache.size = size
+
+
+def post(client, outputs, inputs, state=None):
+    payload = callback_payload(outputs, inputs)
+    payload["state"] = [
+        dict(zip(["id", "property"], name.split(".")), value=value) for name, value in (state or {}).items()
+    ]
+    response = client.post("/_dash-update-component", json=payload)
+    assert response.status_code == 200, outputs
+    return response.get_json()["response"]
+
+
+def test_concurrent_callbacks_keep_their_year(client):
+    countries = constants.nato_countries
+    years = list(range(2014, 2022)) * 4
+
+    def filters(year):
+        inputs = {"year-slider.value": year, "country-filter.value": countries, "map-zoom-bucket.data": 0}
+        state = {"selected-year.data": None, "selected-countries.data": None}
+        return post(client, ["selected-year.data", "map-figure.data", "selected-countries.data"], inputs, state)
+
+    def card(year):
+        return post(client, ["card-sunburst.children"], card_inputs(countries, year))
+
+    expected = {year: card(year) for year in set(years)}
+
+    with ThreadPoolExecutor(8) as pool:
+        stores = list(pool.map(filters, years))
+        rendered = list(pool.map(card, years))
+
+    assert [response["selected-year"]["data"] for response in stores] == years
+    for response, year in zip(rendered, years):
+        assert response == expected[year], year
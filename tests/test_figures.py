@@ -0,0 +1,183 @@
+import copy
+import json
+import os
+import re
+
+import plotly
+import pytest
+
+from mdi import constants
+
+# Figures of every card (and of its modal) compared with golden files rendered by the code before the figures were
+# built on templates and as plain dicts. Figures are compared by their effective layout, the template layout merged
+# under the layout of the figure, so that it does not matter whether a property is set by the template or the figure.
+# python -m tests.test_figures writes the golden files with the code checked out (PROJECT_ROOT set)
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+
+card_ids = [
+    "card-line",
+    "card-sunburst",
+    "card-population",
+    "card-active",
+    "card-theatre",
+    "card-countries-orgs",
+    "card-bar-orgs",
+    "card-mdi",
+]
+
+selections = {
+    "all-2021": (list(constants.country_regions.keys()), 2021),
+    "nato-2016": (constants.nato_countries, 2016),
+    "five-2019": (["CAN", "SVK", "CZE", "POL", "GBR"], 2019),
+    "two-2021": (["CAN", "SVK"], 2021),
+    "one-2021": (["CAN"], 2021),
+}
+
+
+def merge(base, override):
+    if isinstance(base, dict) and isinstance(override, dict):
+        merged = dict(base)
+        for key, value in override.items():
+            merged[key] = merge(base[key], value) if key in base else value
+        return merged
+    return override
+
+
+def effective(figure):
+    """
+    :return: data and layout of the figure with the template layout (and annotation defaults) applied and the
+             default axis anchor and domain left out
+    """
+    layout = copy.deepcopy(figure["layout"])
+    template = layout.pop("template", {}).get("layout", {})
+    annotation_defaults = template.pop("annotationdefaults", {})
+
+    layout = merge(template, layout)
+    if "annotations" in layout:
+        layout["annotations"] = [merge(annotation_defaults, annotation) for annotation in layout["annotations"]]
+    for axis, anchor in (("xaxis", "y"), ("yaxis", "x")):
+        #Plotly defaults, set explicitly by some figures
+        if layout.get(axis, {}).get("anchor") == anchor:
+            del layout[axis]["anchor"]
+        if layout.get(axis, {}).get("domain") == [0, 1]:
+            del layout[axis]["domain"]
+        if "titlefont" in layout.get(axis, {}):
+            font = layout[axis].pop("titlefont")
+            layout[axis].setdefault("title", {})
+            layout[axis]["title"]["font"] = merge(layout[axis]["title"].get("font", {}), font)
+
+    return {"data": figure["data"], "layout": layout}
+
+
+def bars_by_category(figure):
+    """
+    Bar traces as the value of every (trace, category), the organisations bar plot made with plotly express had a
+    bar per row with several rows of "Other" in a country instead of one
+    """
+    bars = {}
+    for trace in figure["data"]:
+        horizontal = trace.get("orientation") == "h"
+        categories, values = (trace["y"], trace["x"]) if horizontal else (trace["x"], trace["y"])
+        for category, value in zip(categories, values):
+            key = f"{trace['name']}|{category}"
+            bars[key] = round(bars.get(key, 0) + value, 6)
+    return bars
+
+
+def collect_figures(component, figures, modals):
+    """
+    Figures of the component tree in figures, figures of the modal bodies (expand-<modal id>-md) in modals. A modal
+    body without a figure is loaded by its callback and appears as the modal id
+    """
+    if isinstance(component, dict):
+        props = component.get("props", {})
+        if isinstance(props.get("figure"), dict):
+            figures.append(props["figure"])
+        match = re.fullmatch(r"expand-(.+)-md", str(props.get("id", "")))
+        if match:
+            modal_figures = []
+            collect_figures(props.get("children"), modal_figures, [])
+            modals.extend(modal_figures or [match.group(1)])
+            return
+        for value in props.values():
+            collect_figures(value, figures, modals)
+    elif isinstance(component, list):
+        for value in component:
+            collect_figures(value, figures, modals)
+
+
+def to_json(component):
+    return json.loads(json.dumps(component, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+def render(card_id, countries, year):
+    """
+    :return: figures of the card followed by the figures of its modal, built inside the card or by its callback
+    """
+    from mdi import update_functions
+
+    figures, modals = [], []
+    collect_figures(to_json(update_functions.update_card(card_id, countries, year)), figures, modals)
+    for modal in modals:
+        if isinstance(modal, str):
+            collect_figures(to_json(update_functions.update_modal(modal, countries, year)), figures, [])
+        else:
+            figures.append(modal)
+    return [effective(figure) for figure in figures]
+
+
+def golden(card_id):
+    with open(os.path.join(GOLDEN_DIR, card_id + ".json")) as f:
+        return json.load(f)
+
+
+def test_templates_keep_litera_trace_defaults():
+    #Figures are compared without the template, the trace defaults of every template have to stay the ones of litera
+    import plotly.io as pio
+    from mdi import templates
+
+    litera = pio.templates["litera"].data.to_plotly_json()
+    for name in templates.template_json:
+        assert templates.template_json[name]["data"] == litera, name
+
+
+@pytest.mark.parametrize("selection", list(selections))
+@pytest.mark.parametrize("card_id", card_ids)
+def test_card_figures(card_id, selection):
+    expected = golden(card_id)[selection]
+    figures = render(card_id, *selections[selection])
+
+    assert len(figures) == len(expected)
+    for figure, expected_figure in zip(figures, expected):
+        if card_id == "card-countries-orgs":
+            assert bars_by_category(figure) == bars_by_category(expected_figure)
+            assert figure["layout"] == expected_figure["layout"]
+        else:
+            assert figure == expected_figure
+
+
+def country_orgs_figure():
+    #Organisations bar plot of two countries without a country order
+    from mdi import plotting_functions, update_functions
+
+    df = update_functions.data_store.top_organisations(["CAN", "USA"], 2021)
+    return effective(to_json(plotting_functions.country_orgs_bar_plot(df)))
+
+
+def test_country_orgs_bar_plot_without_country_order():
+    with open(os.path.join(GOLDEN_DIR, "country_orgs_bar_plot.json")) as f:
+        expected = json.load(f)
+    figure = country_orgs_figure()
+
+    assert bars_by_category(figure) == bars_by_category(expected)
+    assert figure["layout"] == expected["layout"]
+
+
+if __name__ == "__main__":
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    for card_id in card_ids:
+        rendered = {name: render(card_id, *selection) for name, selection in selections.items()}
+        with open(os.path.join(GOLDEN_DIR, card_id + ".json"), "w") as f:
+            json.dump(rendered, f, sort_keys=True, separators=(",", ":"))
+    with open(os.path.join(GOLDEN_DIR, "country_orgs_bar_plot.json"), "w") as f:
+        json.dump(country_orgs_figure(), f, sort_keys=True, separators=(",", ":"))
@@ -0,0 +1,36 @@
+import re
+
+import pytest
+
+from mdi import constants
+from mdi.app import df_deployments, df_presence
+from mdi.update_functions import update_map
+
+# Map traces send only the columns shown on hover as customdata, the hover text has to be the one of the hovertemplates
+# of the whole rows (all columns)
+full_templates = [
+    "<b>Country: %{customdata[5]}</b><br>Theatre: %{customdata[2]} <br>Deployed: %{customdata[9]:,} <br>"
+    "Command: %{customdata[6]} <br>Operation: %{customdata[7]} <br><extra></extra>",
+    "<b>Country: %{customdata[5]}</b><br>Theatre: %{customdata[2]} <br>Deployed: %{customdata[9]} <br>"
+    "Command: %{customdata[6]} <br><extra></extra>",
+]
+
+
+def render_hover(template, customdata):
+    #Server side rendering of the customdata placeholders of a hovertemplate
+    def value(match):
+        return ("{:,}" if match.group(2) else "{}").format(customdata[int(match.group(1))])
+    return re.sub(r"%\{customdata\[(\d+)\](:,)?\}", value, template)
+
+
+@pytest.mark.parametrize("year", range(2014, 2022))
+def test_hover_text_unchanged(year):
+    countries = list(constants.country_regions.keys())
+    figure = update_map(year, countries, True, single_trace=True)
+
+    assert len(figure.data) == 2
+    for trace, df, template in zip(figure.data, [df_deployments, df_presence], full_templates):
+        df = df[df["Country"].isin(countries) & (df["Year"] == year)].sort_values(by="Country", kind="stable")
+        assert len(trace.customdata) == len(df)
+        for full, trimmed in zip(df.to_numpy(), trace.customdata):
+            assert render_hover(trace.hovertemplate, trimmed) == render_hover(template, full)
@@ -0,0 +1,72 @@
+import filecmp
+import json
+import os
+import shutil
+
+import pytest
+
+from util.update_data import FINGERPRINTS, UpdateData
+
+# Derived data files computed again from a copy of the source data, they have to be byte-identical to the files in data/
+
+ROOT = os.environ["PROJECT_ROOT"]
+sources = ["MDVA_Deployments_LatLon.xlsx", "MDVA_ActiveDuty.xlsx", "MDVA_population.csv"]
+
+outputs = {
+    "calculate_per_capita": "deployment_per_capita.csv",
+    "calculate_active_personnel": "active_personnel.csv",
+    "calculate_organisation_breakdown": "top_organisations.csv",
+    "calculate_mdi": "mdi.csv",
+}
+
+
+def copy_sources(root):
+    os.makedirs(root / "data")
+    for source in sources:
+        shutil.copy(ROOT + "data/" + source, root / "data" / source)
+    return str(root) + "/"
+
+
+@pytest.fixture(scope="module")
+def update(tmp_path_factory):
+    return UpdateData(root=copy_sources(tmp_path_factory.mktemp("root")))
+
+
+@pytest.mark.parametrize("method", list(outputs))
+def test_output_unchanged(update, method):
+    getattr(update, method)()
+
+    assert filecmp.cmp(update.root + "data/" + outputs[method], ROOT + "data/" + outputs[method], shallow=False)
+
+
+def test_stored_fingerprints_are_current(update):
+    #Otherwise the next incremental update recomputes everything
+    with open(ROOT + FINGERPRINTS) as f:
+        assert json.load(f) == update.fingerprints()
+
+
+def edit_year(df, year):
+    df = df.copy()
+    df.loc[df["Year"] == year, "Deployed"] -= 1
+    return df
+
+
+def remove_year(df, year):
+    return df[df["Year"] != year]
+
+
+@pytest.mark.parametrize("previous", [edit_year, remove_year], ids=["edited year", "appended year"])
+def test_incremental_update(tmp_path, previous):
+    #Outputs updated from the data before the last year was edited or appended, the same as the full update in data/
+    update = UpdateData(root=copy_sources(tmp_path))
+    deployments = update.df_deployments
+    year = deployments["Year"].max()
+
+    update.df_deployments = previous(deployments, year)
+    update.update()
+    update.df_deployments = deployments
+    assert update.changed_years(update.fingerprints()) == [year]
+
+    update.update(incremental=True)
+    for output in outputs.values():
+        assert filecmp.cmp(update.root + "data/" + output, ROOT + "data/" + output, shallow=False), output
@@ -0,0 +1,531 @@
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import plotly
+
+from mdi import constants, snapshot, update_functions, plotting_functions, templates, metrics
+from mdi.app import ROOT, app, df_deployments, df_presence
+from mdi.figure_cache import figure_cache
+from mdi.update_functions import cards, modals, update_card, update_dashboard, update_map, deployments_by_year, presence_by_year, map_aggregation
+from util.update_data import UpdateData
+
+presets = {
+    "all": list(constants.country_regions.keys()),
+    "nato": constants.nato_countries,
+    "eu": constants.eu_countries,
+    "two": ["CAN", "SVK"],
+    "one": ["CAN"],
+}
+
+
+def timed(function, repeat=5):
+    #Best of n runs, in milliseconds
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def bench_startup():
+    excel = timed(lambda: snapshot.prepare_deployments(pd.read_excel(ROOT + snapshot.DEPLOYMENTS_SOURCE)))
+
+    snapshot.build_snapshots(ROOT)
+    mapped = timed(lambda: snapshot.load_deployments(ROOT))
+
+    print(f"Deployments from xlsx:     {excel:8.1f} ms")
+    print(f"Deployments from snapshot: {mapped:8.1f} ms")
+
+
+def synthetic_update(factor=100):
+    #Repeat the data for factor consecutive blocks of years
+    update = UpdateData()
+    years = update.df_deployments["Year"].unique()
+    span = years.max() - years.min() + 1
+
+    def repeat(df):
+        return pd.concat([df.assign(Year=df["Year"] + k * span) for k in range(factor)], ignore_index=True)
+
+    update.df_deployments = repeat(update.df_deployments)
+    update.df_active = repeat(update.df_active)
+
+    population = {
+        str(year + k * span): update.df_population[str(year)] for year in years for k in range(1, factor)
+    }
+    update.df_population = pd.concat([update.df_population, pd.DataFrame(population)], axis=1)
+
+    return update
+
+
+def bench_etl():
+    #The outputs for the data in data/ are checked by tests/test_update_data.py, timed on 100 times the data
+    etl = ["calculate_per_capita", "calculate_active_personnel", "calculate_organisation_breakdown", "calculate_mdi"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(tmp + "/data")
+        update = synthetic_update(100)
+        update.root = tmp + "/"
+        print(f"Synthetic deployments: {len(update.df_deployments)} rows")
+        for method in etl:
+            print(f"{method:35} {timed(getattr(update, method), repeat=1):8.1f} ms")
+
+
+def bench_incremental():
+    #Incremental update after editing the last year and after appending a year vs the full update, on 100 times the
+    #data. That the outputs are the same as with a full update is checked by tests/test_update_data.py
+    def edit_year(update, year):
+        before = update.df_deployments.copy()
+        before.loc[before["Year"] == year, "Deployed"] -= 1
+        return before
+
+    def append_year(update, year):
+        return update.df_deployments[update.df_deployments["Year"] != year]
+
+    for case, previous_deployments in (("edit a year", edit_year), ("append a year", append_year)):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(tmp + "/data")
+
+            update = synthetic_update(100)
+            deployments = update.df_deployments
+            year = deployments["Year"].max()
+
+            #Data before the change
+            update.df_deployments = previous_deployments(update, year)
+            update.root = tmp + "/"
+            print(f"{case}: full update         {timed(update.update, repeat=1):8.1f} ms")
+
+            update.df_deployments = deployments
+            print(f"{case}: incremental update  {timed(lambda: update.update(incremental=True), repeat=1):8.1f} ms")
+
+
+def callback_payload(outputs, inputs):
+    #Request body of the dash renderer for a callback
+    specs = [dict(zip(["id", "property"], output.split("."))) for output in outputs]
+    return {
+        "output": outputs[0] if len(outputs) == 1 else ".." + "...".join(outputs) + "..",
+        "outputs": specs[0] if len(outputs) == 1 else specs,
+        "inputs": [dict(zip(["id", "property"], name.split(".")), value=value) for name, value in inputs.items()],
+        "changedPropIds": list(inputs),
+        "state": [],
+    }
+
+
+def card_inputs(countries, year, card_id=None):
+    #Stores the card depends on, both if card_id is None
+    stores = {"selected-countries": countries, "selected-year": year}
+    names = cards[card_id]["inputs"] if card_id else list(stores)
+    return {name + ".data": stores[name] for name in names}
+
+
+def bench_cards(threads=8):
+    #Time to first and to all cards with the cards requested in parallel like the dash renderer does, no caching
+    figure_cache.size = 0
+    client = app.server.test_client()
+
+    def request(card_id, countries, year):
+        payload = callback_payload([card_id + ".children"], card_inputs(countries, year, card_id))
+        response = client.post("/_dash-update-component", json=payload)
+        assert response.status_code == 200, card_id
+        return time.perf_counter()
+
+    with ThreadPoolExecutor(threads) as pool:
+        for name, countries in presets.items():
+            request("card-line", countries, 2021)
+            start = time.perf_counter()
+            futures = [pool.submit(request, card_id, countries, 2021) for card_id in cards]
+            finished = [future.result() for future in as_completed(futures)]
+            print(f"{name:5} first card {(min(finished) - start) * 1000:7.1f} ms, "
+                  f"all cards {(max(finished) - start) * 1000:7.1f} ms")
+
+
+def bench_sweep():
+    #Slider sweep 2014 -> 2021 with all countries selected, fires the callbacks the dash renderer would fire
+    figure_cache.size = 0
+    client = app.server.test_client()
+    countries = presets["all"]
+    stores = {"selected-year.data": None, "selected-countries.data": None}
+    filter_outputs = ["selected-year.data", "map-figure.data", "selected-countries.data"]
+
+    def post(outputs, inputs, state=None):
+        payload = callback_payload(outputs, inputs)
+        payload["state"] = [
+            dict(zip(["id", "property"], name.split(".")), value=value) for name, value in (state or {}).items()
+        ]
+        response = client.post("/_dash-update-component", json=payload)
+        assert response.status_code in (200, 204), outputs
+        return response.get_json()["response"] if response.status_code == 200 else {}
+
+    start = time.perf_counter()
+    built = 0
+    for year in range(2014, 2022):
+        inputs = {"year-slider.value": year, "country-filter.value": countries, "map-zoom-bucket.data": 0}
+        response = post(filter_outputs, inputs, state=stores)
+
+        changed = [store for store in stores if store.split(".")[0] in response]
+        for store in changed:
+            stores[store] = response[store.split(".")[0]]["data"]
+
+        for card_id, card in cards.items():
+            if any(store + ".data" in changed for store in card["inputs"]):
+                post([card_id + ".children"], {store + ".data": stores[store + ".data"] for store in card["inputs"]})
+                built += 1
+
+    print(f"Slider sweep: {built} cards built in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+def bench_threads(threads=8):
+    #Concurrent callbacks with different years, the year of every response is checked by tests/test_callbacks.py
+    size = figure_cache.size
+    figure_cache.size = 0
+    client = app.server.test_client()
+    countries = presets["nato"]
+    years = list(range(2014, 2022)) * 4
+
+    def post(outputs, inputs, state=None):
+        payload = callback_payload(outputs, inputs)
+        payload["state"] = [
+            dict(zip(["id", "property"], name.split(".")), value=value) for name, value in (state or {}).items()
+        ]
+        return client.post("/_dash-update-component", json=payload)
+
+    def filters(year):
+        inputs = {"year-slider.value": year, "country-filter.value": countries, "map-zoom-bucket.data": 0}
+        state = {"selected-year.data": None, "selected-countries.data": None}
+        return post(["selected-year.data", "map-figure.data", "selected-countries.data"], inputs, state)
+
+    def card(year):
+        return post(["card-sunburst.children"], card_inputs(countries, year))
+
+    try:
+        with ThreadPoolExecutor(threads) as pool:
+            stores = timed(lambda: list(pool.map(filters, years)), repeat=1)
+            rendered = timed(lambda: list(pool.map(card, years)), repeat=1)
+    finally:
+        figure_cache.size = size
+    print(f"{len(years)} concurrent requests on {threads} threads, filters {stores:7.1f} ms, cards {rendered:7.1f} ms")
+
+
+def figure_json(figure):
+    return json.dumps(figure, cls=plotly.utils.PlotlyJSONEncoder)
+
+
+def bench_map():
+    #Map of all countries with military presence, one trace per country vs a single trace
+    countries = presets["all"]
+    for single_trace in (False, True):
+        figure = update_map(2021, countries, True, single_trace=single_trace)
+        build = timed(lambda: figure_json(update_map(2021, countries, True, single_trace=single_trace)))
+        print(f"{'single trace' if single_trace else 'per country':12} {len(figure.data):3} traces, "
+              f"{len(figure_json(figure)):8} bytes, {build:6.1f} ms")
+
+
+def bench_hover():
+    #Map payload with the whole rows (all columns) as customdata vs the hover columns only, the hover text is checked to
+    #be the same by tests/test_map.py
+    countries = presets["all"]
+    figure = update_map(2021, countries, True, single_trace=True)
+    trimmed_bytes = len(figure_json(figure))
+    for trace, df in zip(figure.data, [df_deployments, df_presence]):
+        df = df[df["Country"].isin(countries) & (df["Year"] == 2021)]
+        trace.customdata = df.sort_values(by="Country", kind="stable")
+    full_bytes = len(figure_json(figure))
+
+    print(f"Map payload (all countries, 2021): all columns {full_bytes} bytes, hover columns {trimmed_bytes} bytes")
+
+
+def bench_map_years():
+    #update_map for every year with all countries, deployments and presence
+    countries = presets["all"]
+    years = range(2014, 2022)
+
+    def query():
+        for year in years:
+            for df in (df_deployments, df_presence):
+                dfp = df.query("Country in @selected & Year == @year", local_dict={"selected": countries, "year": year})
+                dfp.sort_values(by="Country")
+
+    def partitions():
+        for year in years:
+            for partition in (deployments_by_year, presence_by_year):
+                partition.select(year, countries)
+
+    print(f"Filtering, query and sort:  {timed(query, repeat=10):7.1f} ms")
+    print(f"Filtering, year partitions: {timed(partitions, repeat=10):7.1f} ms")
+    total = timed(lambda: [update_map(year, countries, True) for year in years], repeat=10)
+    print(f"update_map, all countries, 8 years: {total:7.1f} ms")
+
+
+def bench_map_zoom():
+    #Markers, payload and build time of the map for every zoom bucket, all countries with military presence
+    countries = presets["all"]
+    levels = [0] + constants.map_zoom_levels
+
+    for bucket, (level, cell) in enumerate(zip(levels, map_aggregation)):
+        figure = update_map(2021, countries, True, zoom_bucket=bucket)
+        build = timed(lambda: figure_json(update_map(2021, countries, True, zoom_bucket=bucket)))
+        grid = "every row" if cell is None else "same location" if cell == 0 else f"{cell} degree grid"
+        print(f"zoom >= {level:<3} {grid:13} {sum(len(trace.lat) for trace in figure.data):5} markers, "
+              f"{len(figure_json(figure)):7} bytes, {build:6.1f} ms")
+
+
+def bench_map_backend():
+    #Server side cost of the map figure (build and serialisation) for every year with both map backends
+    countries = presets["all"]
+    backend = update_functions.map_backend
+    try:
+        for update_functions.map_backend in ("mapbox", "offline"):
+            build = timed(lambda: [figure_json(update_map(year, countries, True)) for year in range(2014, 2022)])
+            style = update_map(2021, countries, True).layout.mapbox.style
+            print(f"{update_functions.map_backend:8} ({style:8}) 8 years: {build:7.1f} ms")
+    finally:
+        update_functions.map_backend = backend
+
+
+def bench_figures():
+    #Construction time of every chart type, all countries 2021
+    countries = presets["all"]
+    cube = update_functions.deployments_cube
+    by_year = cube.sum(countries, by=["Country", "Year"])
+    country_list = cube.countries(countries)
+    mdi = update_functions.data_store.mdi(countries)
+    df_orgs = update_functions.data_store.top_organisations(countries, 2021)
+    df_capita = update_functions.data_store.deployment_per_capita(countries, 2021).sort_values(
+        by="Deployment Per Capita", ascending=False
+    )
+    values = df_capita["Deployment Per Capita"]
+    line = [dict(x=list(range(2014, 2022)), y=list(range(8)), colour="red", title="", x_label="Year", y_label="MDI")]
+
+    figures = {
+        "line_chart": lambda: plotting_functions.line_chart(line),
+        "horizontal_bar_plot": lambda: plotting_functions.horizontal_bar_plot(
+            values, df_capita["Country Name"], values, values.max()
+        ),
+        "meter_plot": lambda: plotting_functions.meter_plot(40, 1000, {"min": 0, "max": 100}),
+        "country_orgs_bar_plot": lambda: plotting_functions.country_orgs_bar_plot(
+            df_orgs, country_order=list(df_orgs["Country"].unique())
+        ),
+        "update_line_plot": lambda: update_functions.update_line_plot(by_year, country_list),
+        "update_mdi_plot": lambda: update_functions.update_mdi_plot(mdi),
+    }
+    for name, build in figures.items():
+        print(f"{name:22} {timed(build, repeat=20):7.2f} ms")
+
+
+def bench_raw_figures():
+    #Every card built from plain dict figures has to give the same json as with graph_objects (tests/test_figures.py
+    #compares both with the figures before the change), then cpu time of the dashboard (build and json) for the
+    #preset selections with both
+    figure_cache.size = 0
+    raw_figures = templates.raw_figures
+
+    def card_json(card_id, countries, year, raw):
+        templates.raw_figures = raw
+        return json.loads(plotly.io.json.to_json_plotly(update_card(card_id, countries, year)))
+
+    try:
+        different = {card_id: 0 for card_id in cards}
+        for countries in list(presets.values()) + [["CAN"]]:
+            for year in range(2014, 2022):
+                for card_id in cards:
+                    different[card_id] += card_json(card_id, countries, year, False) != card_json(
+                        card_id, countries, year, True
+                    )
+        for card_id, count in different.items():
+            print(f"{card_id:22} {'identical' if not count else f'{count} DIFFERENT'}")
+        assert not any(different.values()), "plain dict figures differ from graph_objects"
+
+        for templates.raw_figures in (False, True):
+            start = time.process_time()
+            for countries in presets.values():
+                for year in range(2014, 2022):
+                    plotly.io.json.to_json_plotly(update_dashboard(countries, year))
+            elapsed = (time.process_time() - start) * 1000
+            print(f"{'plain dicts' if templates.raw_figures else 'graph_objects':14} "
+                  f"{len(presets) * 8} dashboards, cpu {elapsed:7.0f} ms")
+    finally:
+        templates.raw_figures = raw_figures
+
+
+def bench_payload():
+    #Size of the card responses of the dashboard with all countries selected
+    client = app.server.test_client()
+    total = 0
+    for card_id in cards:
+        payload = callback_payload([card_id + ".children"], card_inputs(presets["all"], 2021, card_id))
+        size = len(client.post("/_dash-update-component", json=payload).data)
+        total += size
+        print(f"{card_id:22} {size:8} bytes")
+    print(f"{'all cards':22} {total:8} bytes")
+
+    #Modal graphs, only sent when the expand button is clicked
+    for modal_id in modals:
+        payload = callback_payload([f"expand-{modal_id}-md.children"], {f"expand_{modal_id}.n_clicks": 1})
+        payload["state"] = [
+            {"id": "selected-countries", "property": "data", "value": presets["all"]},
+            {"id": "selected-year", "property": "data", "value": 2021},
+        ]
+        response = client.post("/_dash-update-component", json=payload)
+        assert response.status_code == 200, modal_id
+        print(f"{'modal ' + modal_id:22} {len(response.data):8} bytes")
+
+
+def bench_cube():
+    #Sums of the cards from the deployments cube against grouping the rows of the selection, for 1, 2 and all
+    #countries in 2021 (line card over all years)
+    cube = update_functions.deployments_cube
+    df = update_functions.df_deployments
+    queries = {
+        "Country, Year": (["Country", "Year"], None),
+        "Organisation, MissionName": (["Organisation", "MissionName"], 2021),
+        "Theatre": ("Theatre", 2021),
+        "Organisation": ("Organisation", 2021),
+    }
+    print(f"cube of {len(cube.values)} cells from {len(df)} rows")
+
+    for name in ("one", "two", "all"):
+        countries = presets[name]
+        for query, (by, year) in queries.items():
+            def grouped():
+                dfp = df[df["Country"].isin(countries)]
+                if year is not None:
+                    dfp = dfp[dfp["Year"] == year]
+                return dfp.groupby(by, observed=True)["Deployed"].sum()
+
+            expected, result = grouped(), cube.sum(countries, year, by)
+            assert list(expected.index) == list(result.index) and (expected.values == result.values).all(), query
+            print(
+                f"{name:4} {query:26} groupby {timed(grouped, repeat=20):6.2f} ms"
+                f"  cube {timed(lambda: cube.sum(countries, year, by), repeat=20):6.2f} ms"
+            )
+
+
+def bench_select():
+    #Filtering the tables with the boolean country lookup against df.query, for the NATO and EU presets in 2021
+    tables = {name: update_functions.data_store.table(name) for name in update_functions.data_store.tables}
+    frames = {name: table.df.drop(columns="CountryId").sort_index() for name, table in tables.items()}
+    df = update_functions.df_deployments
+    year = 2021
+
+    for name in ("nato", "eu"):
+        countries = presets[name]
+        for table, frame in frames.items():
+            def query():
+                return frame.query(
+                    "Country in @countries and Year == @year", local_dict=dict(countries=countries, year=year)
+                )
+
+            expected = query()
+            result = tables[table].select(countries, year)
+            assert (result.index == expected.index).all(), table
+            print(
+                f"{name:4} {table:22} query {timed(query, repeat=20):6.3f} ms"
+                f"  lookup {timed(lambda: tables[table].select(countries, year), repeat=20):6.3f} ms"
+            )
+
+        def query():
+            return df.query(
+                "Country in @countries and Year == @year", local_dict=dict(countries=countries, year=year)
+            )
+
+        print(
+            f"{name:4} {'deployments':22} query {timed(query, repeat=20):6.3f} ms"
+            f"  lookup {timed(lambda: deployments_by_year.select(year, countries), repeat=20):6.3f} ms"
+        )
+
+
+def bench_compression():
+    #Bytes sent for the dashboard with all countries selected in 2021 (filters with the map and all cards), uncompressed
+    #and with every encoding the server offers
+    figure_cache.size = 0
+    client = app.server.test_client()
+    countries = presets["all"]
+
+    filters = callback_payload(
+        ["selected-year.data", "map-figure.data", "selected-countries.data"],
+        {"year-slider.value": 2021, "country-filter.value": countries, "map-zoom-bucket.data": 0},
+    )
+    filters["state"] = [
+        {"id": "selected-year", "property": "data", "value": None},
+        {"id": "selected-countries", "property": "data", "value": None},
+    ]
+    requests = {"filters": filters}
+    for card_id in cards:
+        requests[card_id] = callback_payload([card_id + ".children"], card_inputs(countries, 2021, card_id))
+
+    encodings = ["identity", "gzip", "br"]
+    totals = dict.fromkeys(encodings, 0)
+    for name, payload in requests.items():
+        sizes = []
+        for encoding in encodings:
+            response = client.post("/_dash-update-component", json=payload, headers={"Accept-Encoding": encoding})
+            assert response.status_code == 200, name
+            assert response.headers.get("Content-Encoding", "identity") == encoding, (name, encoding)
+            sizes.append(len(response.data))
+            totals[encoding] += len(response.data)
+        print(f"{name:22} " + "  ".join(f"{encoding} {size:7}" for encoding, size in zip(encodings, sizes)))
+
+    print(f"{'dashboard':22} " + "  ".join(f"{encoding} {size:7}" for encoding, size in totals.items()))
+    for encoding in encodings[1:]:
+        print(f"{encoding:8} {totals[encoding] / totals['identity'] * 100:5.1f} % of the uncompressed bytes")
+
+
+def bench_metrics():
+    #Time the callback instrumentation adds to every request, the time to render /metrics with full windows and to
+    #save them for the other workers (once per interval under gunicorn)
+    client = app.server.test_client()
+    payload = callback_payload(["card-sunburst.children"], card_inputs(presets["nato"], 2021, "card-sunburst"))
+    response = client.post("/_dash-update-component", json=payload)
+    assert response.status_code == 200
+
+    def record():
+        countries, year = metrics.selection(payload)
+        values = (0.01, 0.01, len(response.data), countries)
+        metrics.callback_metrics.record(metrics.callback_name(payload), values, year)
+
+    print(f"record per request   {timed(record, repeat=1000) * 1000:7.1f} us")
+
+    for card_id in cards:
+        for _ in range(metrics.window):
+            metrics.callback_metrics.record(card_id, (0.01, 0.01, 10000, 34), 2021)
+    print(f"/metrics ({len(cards)} full windows) {timed(lambda: client.get('/metrics')):7.1f} ms")
+
+    previous = metrics.callback_metrics.directory
+    with tempfile.TemporaryDirectory() as directory:
+        metrics.callback_metrics.directory = directory
+        try:
+            print(f"save ({len(cards)} full windows)     {timed(metrics.callback_metrics.save):7.1f} ms")
+        finally:
+            metrics.callback_metrics.directory = previous
+
+
+benchmarks = {
+    "startup": bench_startup,
+    "etl": bench_etl,
+    "incremental": bench_incremental,
+    "cards": bench_cards,
+    "sweep": bench_sweep,
+    "threads": bench_threads,
+    "map": bench_map,
+    "hover": bench_hover,
+    "map_years": bench_map_years,
+    "map_zoom": bench_map_zoom,
+    "map_backend": bench_map_backend,
+    "figures": bench_figures,
+    "raw_figures": bench_raw_figures,
+    "payload": bench_payload,
+    "cube": bench_cube,
+    "select": bench_select,
+    "compression": bench_compression,
+    "metrics": bench_metrics,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or benchmarks:
+        print(f"--- {name}")
+        benchmarks[name]()
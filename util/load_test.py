@@ -0,0 +1,100 @@
+import os
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from util.benchmark import callback_payload, card_inputs, presets
+from mdi.app import ROOT
+from mdi.update_functions import cards
+
+# Throughput of the dashboard callbacks served by gunicorn with gunicorn.conf.py at different workers x threads
+# settings, e.g. python -m util.load_test 1x1 1x4 2x4. Every view is the 8 cards of a random selection and year,
+# requested by concurrent clients like browsers after a filter change. The figure cache is off so that every request
+# renders, MDI_FIGURE_CACHE_SIZE=256 python -m util.load_test measures with the cache
+
+port = 8051
+clients = 16
+views = 40
+
+
+def start_server(workers, threads):
+    env = dict(
+        os.environ,
+        PROJECT_ROOT=ROOT,
+        MDI_BIND=f"127.0.0.1:{port}",
+        MDI_WORKERS=str(workers),
+        MDI_THREADS=str(threads),
+        MDI_WARMUP="0",
+        MDI_FIGURE_CACHE_SIZE=os.getenv("MDI_FIGURE_CACHE_SIZE", "0"),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "wsgi:server"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    #Wait until the workers answer
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/", timeout=5).ok:
+                return server
+        except requests.ConnectionError:
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError(f"gunicorn with {workers}x{threads} did not start")
+
+
+def card_requests():
+    #Same random views for every setting
+    choice = random.Random(0)
+    payloads = []
+    for _ in range(views):
+        countries = presets[choice.choice(list(presets))]
+        year = choice.randrange(2014, 2022)
+        for card_id in cards:
+            payloads.append(callback_payload([card_id + ".children"], card_inputs(countries, year, card_id)))
+    return payloads
+
+
+def run(workers, threads):
+    payloads = card_requests()
+    server = start_server(workers, threads)
+    try:
+        session = requests.Session()
+
+        def post(payload):
+            start = time.perf_counter()
+            response = session.post(f"http://127.0.0.1:{port}/_dash-update-component", json=payload, timeout=120)
+            response.raise_for_status()
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(clients) as pool:
+            latencies = np.array(list(pool.map(post, payloads))) * 1000
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(
+        f"{workers:2} workers x {threads:2} threads  {len(payloads) / elapsed:6.1f} requests/s  "
+        f"p50 {np.percentile(latencies, 50):7.1f} ms  p95 {np.percentile(latencies, 95):7.1f} ms  "
+        f"max {latencies.max():7.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    cpus = os.cpu_count()
+    settings = sys.argv[1:] or list(dict.fromkeys(["1x1", "1x4", f"{cpus}x1", f"{cpus}x4", f"{2 * cpus}x4"]))
+    print(f"{views * len(cards)} card requests from {clients} clients, {cpus} CPUs")
+    for setting in settings:
+        workers, threads = (int(value) for value in setting.split("x"))
+        run(workers, threads)
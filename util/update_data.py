@@ -1,141 +1,243 @@
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
 import pandas as pd
 
-from mdi.plotting_functions import percentage_calculate
 from mdi import constants
-from mdi.index import calculate_mdi
+from mdi.index import calculate_mdi_all_years
+from mdi.snapshot import build_snapshots
 from mdi.app import ROOT
 
+# Fingerprints of the source rows of every year, stored next to the derived outputs
+FINGERPRINTS = "data/update_fingerprints.json"
+
+
+#Vectorised percentage_calculate from mdi.plotting_functions, same rounding and 0 for zero denominators
+def percentage_array(n, d, scaling=1):
+    n = np.asarray(n, dtype="float64")
+    d = np.asarray(d, dtype="float64")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        number = np.round((n / d) * scaling, 1)
+    return np.where(d == 0, 0, number)
+
+
+def partition_hashes(df, by):
+    #sha256 of the row hashes of every partition
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return {
+        key: hashlib.sha256(row_hashes[positions].tobytes()).hexdigest()
+        for key, positions in df.groupby(by, sort=False).indices.items()
+    }
+
+
+#Write to a temporary file first so that readers never see a partially written output
+def write_csv(df, path):
+    df.to_csv(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+
+
 class UpdateData:
-    def __init__(self):
+    def __init__(self, root=ROOT):
+        self.root = root
+
         # Load data from files
-        df_deploy_full = pd.read_excel(ROOT + "data/MDVA_Deployments_LatLon.xlsx")
-        self.df_active = pd.read_excel(ROOT + "data/MDVA_ActiveDuty.xlsx")
-        self.df_population = pd.read_csv(ROOT + "data/MDVA_Population.csv", delimiter=",")
+        df_deploy_full = pd.read_excel(root + "data/MDVA_Deployments_LatLon.xlsx")
+        self.df_active = pd.read_excel(root + "data/MDVA_ActiveDuty.xlsx")
+        self.df_population = pd.read_csv(root + "data/MDVA_population.csv", delimiter=",")
 
         # Query deployments and presence
         self.df_deployments = df_deploy_full[df_deploy_full["MissionType"] == "Operation"]
         self.df_presence = df_deploy_full[df_deploy_full["MissionType"] == "MilitaryPresence"]
 
-    def calculate_per_capita(self):
+    def ordered_deployments(self, years=None):
+        """
+        Deployments with Year and Country as categoricals ordered by first appearance, so that sorted groupbys
+        give the year by year, country by country order of the output files.
+        :param years: only keep deployments in these years, all years if None
+        """
         df_deploy = self.df_deployments
-        df_population = self.df_population
-        df = pd.DataFrame(columns=["Country", "Country Name", "Year", "Deployment Per Capita"])
+        year_order = df_deploy["Year"].unique()
+        country_order = df_deploy["Country"].unique()
+
+        if years is not None:
+            year_order = [year for year in year_order if year in years]
+            df_deploy = df_deploy[df_deploy["Year"].isin(year_order)]
+
+        df_deploy = df_deploy.copy()
+        df_deploy["Year"] = pd.Categorical(df_deploy["Year"], categories=year_order)
+        df_deploy["Country"] = pd.Categorical(df_deploy["Country"], categories=country_order)
+        return df_deploy
+
+    def country_year_totals(self, years=None):
+        # Total deployment of every country in every year (0 if no deployment in that year)
+        df = (
+            self.ordered_deployments(years)
+            .groupby(["Year", "Country"], observed=False)["Deployed"]
+            .sum()
+            .reset_index()
+        )
+        df["Year"] = df["Year"].astype("int64")
+        df["Country"] = df["Country"].astype("object")
+        df["Country Name"] = df["Country"].map(constants.country_codes)
+        return df
+
+    def population(self):
+        # Population table in long format (Country, Year, Population) for deployment years and countries
+        df_deploy = self.df_deployments
+        years = [str(year) for year in df_deploy["Year"].unique()]
+        countries = df_deploy["Country"].unique()
+
+        df = self.df_population[self.df_population["Country"].isin(countries)]
+        df = df.melt(id_vars=["Country"], value_vars=years, var_name="Year", value_name="Population")
+        df["Year"] = df["Year"].astype("int64")
+        df["Population"] = df["Population"].astype("int64")
+        return df
+
+    def save(self, df, filename, years=None):
+        """
+        :param df: derived output for the given years
+        :param years: None if df is the full output, otherwise rows of these years replace the ones in the existing
+                      file, rows of the other years are copied as they are
+        """
+        path = self.root + "data/" + filename
+
+        if years is None:
+            write_csv(df, path)
+            return None
+
+        with open(path, "r") as f:
+            header, *lines = f.read().splitlines(keepends=True)
+        existing_years = pd.read_csv(path, delimiter=",", usecols=["Year"])["Year"].to_numpy()
+
+        blocks = {}
+        for year, line in zip(existing_years, lines):
+            blocks.setdefault(year, []).append(line)
+        for year in years:
+            blocks[year] = [df[df["Year"] == year].to_csv(header=False, index=False)]
+
+        # Keep the year order of the deployments
+        with open(path + ".tmp", "w") as f:
+            f.write(header)
+            for year in self.df_deployments["Year"].unique():
+                f.writelines(blocks.get(year, []))
+        os.replace(path + ".tmp", path)
+
+    def calculate_per_capita(self, years=None):
+        df = self.country_year_totals(years).merge(self.population(), on=["Country", "Year"], how="left",
+                                                   validate="1:1")
 
-        for year in df_deploy["Year"].unique():
         # Calculate deployment per 100,000 capita for each country
-            for country in df_deploy["Country"].unique():
-                total_deployed = df_deploy.query("Country == @country & Year == @year")["Deployed"].sum()
-
-                population = int(df_population.query("Country == @country")[str(year)])
-                country_name = constants.country_codes[country]
-
-                df = pd.concat(
-                    [
-                        df,
-                        pd.DataFrame(
-                            [
-                                [
-                                    country,
-                                    country_name,
-                                    year,
-                                    percentage_calculate(total_deployed, population, 100000),
-                                ]
-                            ],
-                            columns=["Country", "Country Name", "Year", "Deployment Per Capita"],
-                        ),
-                    ]
-                )
-        df.to_csv(ROOT + 'data/deployment_per_capita.csv', index=False)
+        df["Deployment Per Capita"] = percentage_array(df["Deployed"], df["Population"], 100000)
+
+        df = df.loc[:, ["Country", "Country Name", "Year", "Deployment Per Capita"]]
+        self.save(df, "deployment_per_capita.csv", years)
         print("Saved deployment per capita data to deployment_per_capita.csv")
         return None
 
-    def calculate_mdi(self):
-        df_deployments = self.df_deployments
-        mdi = None
-        for year in df_deployments["Year"].unique():
-            df = calculate_mdi(df_deployments, year)
-            df["Year"] = year
-            if mdi is None:
-                mdi = df
-            else:
-                mdi = pd.concat([mdi, df])
-        mdi.to_csv(ROOT + 'data/mdi.csv', index=False)
+    def calculate_mdi(self, years=None):
+        mdi = calculate_mdi_all_years(self.df_deployments, self.df_population, years=years)
+        self.save(mdi, "mdi.csv", years)
         print("Saved mdi data to mdi.csv")
 
         return None
 
+    def calculate_active_personnel(self, years=None):
+        df_active = self.df_active.loc[:, ["Country", "Year", "Personnel_Count"]]
+        df = self.country_year_totals(years).merge(df_active, on=["Country", "Year"], how="left", validate="1:1")
 
-    def calculate_active_personnel(self):
-        df_deploy = self.df_deployments
-        df_active = self.df_active
-        df = pd.DataFrame(columns=["Country", "Country Name", "Year", "Percent of Active Personnel", "Total Deployed"])
-
-        for year in df_deploy["Year"].unique():
-            for country in df_deploy["Country"].unique():
-                total_deployed = df_deploy.query("Country == @country & Year == @year")["Deployed"].sum()
-                active_personnel = int( df_active.query("Country == @country & Year == @year")["Personnel_Count"])
-                country_name = constants.country_codes[country]
-
-                df = pd.concat(
-                    [
-                        df,
-                        pd.DataFrame(
-                            [
-                                [
-                                    country,
-                                    country_name,
-                                    year,
-                                    percentage_calculate(total_deployed, active_personnel, 100),
-                                    total_deployed,
-                                ]
-                            ],
-                            columns=[
-                                "Country",
-                                "Country Name",
-                                "Year",
-                                "Percent of Active Personnel",
-                                "Total Deployed",
-                            ],
-                        ),
-                    ]
-                )
-
-        df.to_csv(ROOT + 'data/active_personnel.csv', index=False)
-        print("Saved active personnel data to active_personnel.csv")
-
-    def calculate_organisation_breakdown(self):
-        df_deploy = self.df_deployments
+        df["Percent of Active Personnel"] = percentage_array(df["Deployed"], df["Personnel_Count"], 100)
+        df["Total Deployed"] = df["Deployed"]
 
-        df = pd.DataFrame(columns=["Country", "Year", "Organisation", "Deployed", "Percentage of Total Deployment"])
+        df = df.loc[:, ["Country", "Country Name", "Year", "Percent of Active Personnel", "Total Deployed"]]
+        self.save(df, "active_personnel.csv", years)
+        print("Saved active personnel data to active_personnel.csv")
 
-        for year in df_deploy["Year"].unique():
-            for country in df_deploy["Country"].unique():
-                df_country = df_deploy.query("Country == @country & Year == @year")
-                country_sum = df_country["Deployed"].sum()
+    def calculate_organisation_breakdown(self, years=None):
+        df_deploy = self.ordered_deployments(years)
 
-                df_country = df_country.groupby(['Country', 'Organisation', "Year"])['Deployed'].sum().reset_index()
+        df = df_deploy.groupby(["Year", "Country", "Organisation"], observed=True)["Deployed"].sum().reset_index()
+        country_sum = df.groupby(["Year", "Country"], observed=True)["Deployed"].transform("sum")
 
-                def _calc_total_deploy_percentage(row):
-                    percentage = percentage_calculate(
-                        row["Deployed"],
-                        country_sum,
-                        scaling=100,
-                    )
-                    return percentage
+        df["Percentage of Total Deployment"] = percentage_array(df["Deployed"], country_sum, scaling=100)
+        df["Year"] = df["Year"].astype("int64")
 
-                df_country["Percentage of Total Deployment"] = df_country.apply(
-                    _calc_total_deploy_percentage, axis=1
-                )
+        df = df.loc[:, ["Country", "Year", "Organisation", "Deployed", "Percentage of Total Deployment"]]
+        self.save(df, "top_organisations.csv", years)
+        print("Saved top organisations data to top_organisations.csv")
 
-                df = pd.concat([df, df_country.loc[:, ["Country", "Year", "Organisation", "Deployed", "Percentage of Total Deployment"]]])
+    def fingerprints(self):
+        """
+        :return: fingerprint of the country order (used by every year) and of the source rows of every year. The year
+                 order is not part of it, save() takes it from the deployments, so a new year is a changed year
+        """
+        df_deploy = self.df_deployments
+        years = df_deploy["Year"].unique()
+        countries = df_deploy["Country"].unique()
+
+        df_population = self.df_population[self.df_population["Country"].isin(countries)]
+        df_population = df_population.set_index("Country").loc[countries]
+
+        deployments = partition_hashes(df_deploy, "Year")
+        active = partition_hashes(self.df_active, "Year")
+        population = pd.util.hash_pandas_object(df_population.loc[:, [str(year) for year in years]].T, index=True)
+
+        fingerprints = {}
+        for year in years:
+            parts = [deployments[year], active.get(year, ""), str(population[str(year)])]
+            fingerprints[str(year)] = hashlib.sha256("".join(parts).encode()).hexdigest()
+
+        order = json.dumps(list(countries))
+        return {"order": hashlib.sha256(order.encode()).hexdigest(), "years": fingerprints}
+
+    def changed_years(self, fingerprints):
+        """
+        :return: years whose source rows changed since the last update, None if everything has to be recomputed
+        """
+        try:
+            with open(self.root + FINGERPRINTS, "r") as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # Adding a country or reordering changes the rows of every year, the rows of a removed year are only dropped
+        # by a full update
+        if previous.get("order") != fingerprints["order"] or set(previous["years"]) - set(fingerprints["years"]):
+            return None
+
+        return [
+            int(year) for year, fingerprint in fingerprints["years"].items()
+            if previous["years"].get(year) != fingerprint
+        ]
+
+    def update(self, incremental=False):
+        fingerprints = self.fingerprints()
+        years = self.changed_years(fingerprints) if incremental else None
+
+        if years == []:
+            print("No changes in source data")
+        else:
+            # MDI z-scores are per year, so a changed year is recomputed on its own
+            if years is not None:
+                print(f"Updating years {years}")
+            self.calculate_per_capita(years)
+            self.calculate_mdi(years)
+            self.calculate_active_personnel(years)
+            self.calculate_organisation_breakdown(years)
+
+        self.save_fingerprints(fingerprints)
+
+    def save_fingerprints(self, fingerprints):
+        with open(self.root + FINGERPRINTS + ".tmp", "w") as f:
+            json.dump(fingerprints, f, indent=1)
+            f.write("\n")
+        os.replace(self.root + FINGERPRINTS + ".tmp", self.root + FINGERPRINTS)
 
-        df.to_csv(ROOT + 'data/top_organisations.csv', index=False)
-        print("Saved top organisations data to top_organisations.csv")
 
 if __name__ == "__main__":
     update = UpdateData()
-    update.calculate_per_capita()
-    update.calculate_mdi()
-    update.calculate_active_personnel()
-    update.calculate_organisation_breakdown()
-    print("Finishes updating")
\ No newline at end of file
+    update.update(incremental="--incremental" in sys.argv[1:])
+    build_snapshots(ROOT)
+    print("Finishes updating")
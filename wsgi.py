@@ -1,5 +1,14 @@
+import os
+
 from mdi.app import app
 from mdi.app import server
+from mdi.warmup import start_warmup
+
+# gunicorn (gunicorn.conf.py) warms the figure cache itself. Preloaded, the master warms before forking the workers
+# (for at most MDI_WARMUP_BUDGET seconds), so the workers start with the cache but only after the warm-up
 
 if __name__ == "__main__":
+    # Pre-render the popular dashboard views in the background, disable with MDI_WARMUP=0
+    if os.getenv("MDI_WARMUP", "1") != "0":
+        start_warmup()
     app.run_server()